@@ -10,7 +10,7 @@ This file contains functions to do boundary conditions:
     -
     
 Features:
-    -
+    -Ensemble runs; BCs of each member applied to its own row of variables
 
 Desired:
     -
@@ -26,13 +26,11 @@ class BCs():
         self.BCs=BC_dict
         self.dx=dx
         
-    # Energy BCs
-    def Energy(self, E, T_prev, dt, rhoC, hx):
+    # Energy BCs as rate of change at boundary nodes (flux, convective, radiation)
+    # Fixed temperature boundaries are held constant; see Energy_fixed
+    def Energy_rate(self, dE, T_prev, hx):
         # Left face
-        if self.BCs['bc_left_E'][0]=='T':
-            E[0]=self.BCs['bc_left_E'][1]*rhoC[0]
-                
-        else:
+        if self.BCs['bc_left_E'][0]!='T':
             if self.BCs['bc_left_E'][0]=='F':
                 q=self.BCs['bc_left_E'][1]
                 Bi=0
@@ -41,13 +39,10 @@ class BCs():
                 q=self.BCs['bc_left_E'][1][0]*self.BCs['bc_left_E'][1][1] # h*Tinf
                 Bi=-self.BCs['bc_left_E'][1][0]*T_prev[0] # h*Tij
             
-            E[0]+=(Bi+q)*dt/hx[0]
+            dE[0]+=(Bi+q)/hx[0]
             
         # Right face
-        if self.BCs['bc_right_E'][0]=='T':
-            E[-1]=self.BCs['bc_right_E'][1]*rhoC[-1]
-                
-        else:
+        if self.BCs['bc_right_E'][0]!='T':
             if self.BCs['bc_right_E'][0]=='F':
                 q=self.BCs['bc_right_E'][1]
                 Bi=0
@@ -56,17 +51,42 @@ class BCs():
                 q=self.BCs['bc_right_E'][1][0]*self.BCs['bc_right_E'][1][1] # h*Tinf
                 Bi=-self.BCs['bc_right_E'][1][0]*T_prev[-1] # h*Tij
             
-            E[-1]+=(Bi+q)*dt/hx[-1]
+            dE[-1]+=(Bi+q)/hx[-1]
             
         # Apply radiation BCs
         if self.BCs['bc_left_rad']!='None':
-            E[0]+=dt/hx[0]*\
+            dE[0]+=1/hx[0]*\
                 self.BCs['bc_left_rad'][0]*5.67*10**(-8)*\
                 (self.BCs['bc_left_rad'][1]**4-T_prev[0]**4)
         if self.BCs['bc_right_rad']!='None':
-            E[-1]+=dt/hx[-1]*\
+            dE[-1]+=1/hx[-1]*\
                 self.BCs['bc_right_rad'][0]*5.67*10**(-8)*\
                 (self.BCs['bc_right_rad'][1]**4-T_prev[-1]**4)
+    
+    # Fixed temperature energy BCs (applied after time step)
+    def Energy_fixed(self, E, rhoC):
+        # Left face
+        if self.BCs['bc_left_E'][0]=='T':
+            E[0]=self.BCs['bc_left_E'][1]*rhoC[0]
+        
+        # Right face
+        if self.BCs['bc_right_E'][0]=='T':
+            E[-1]=self.BCs['bc_right_E'][1]*rhoC[-1]
+            
+    # Energy BCs for implicit solver (temperature is the unknown)
+    # Flux, convective and radiation BCs are applied explicitly in Energy_rate
+    def Energy_implicit(self, a, b, c, d):
+        # Left face
+        if self.BCs['bc_left_E'][0]=='T':
+            b[0]=1.0
+            c[0]=0
+            d[0]=self.BCs['bc_left_E'][1]
+        
+        # Right face
+        if self.BCs['bc_right_E'][0]=='T':
+            a[-1]=0
+            b[-1]=1.0
+            d[-1]=self.BCs['bc_right_E'][1]
             
     # Conservation of mass BCs
     def mass(self, m, P, Ax, Ay):
@@ -117,9 +137,12 @@ class BCs():
                     m[-1,-1]=self.BCs['bc_north_mass'][-2]*self.dy[-1,-1]+m[-2,-1]
         return 0
     
-    # Pressure BCs (eventually lead to momentum)
-    def P(self, P, R, T):
-        flx=np.zeros_like(P)
+    # Pressure BCs (eventually lead to momentum); flux put in flx if given
+    def P(self, P, R, T, flx=None):
+        if flx is None:
+            flx=np.zeros_like(P)
+        else:
+            flx[:]=0
         # Left face
         if self.BCs['bc_left_P'][0]=='grad':
             P_0=P[1]-self.BCs['bc_left_P'][1]*self.dx[0]
@@ -139,4 +162,29 @@ class BCs():
             P_0=P[-1]
         
         flx[-1]=min((P_0-P[-1])/(R*T[-1]),0) # Required flux to get Pressure BC
-        return flx
\ No newline at end of file
+        return flx
+
+# BCs of ensemble members (variables have leading axis for each member)
+# Each member has its own BCs object so they can be changed separately (ignition)
+class Ensemble_BCs():
+    def __init__(self, BC_list, dx):
+        self.members=[BCs(BC_dict, dx) for BC_dict in BC_list]
+    
+    def Energy_rate(self, dE, T_prev, hx):
+        for i in range(len(self.members)):
+            self.members[i].Energy_rate(dE[i], T_prev[i], hx)
+    
+    def Energy_fixed(self, E, rhoC):
+        for i in range(len(self.members)):
+            self.members[i].Energy_fixed(E[i], rhoC[i])
+    
+    def Energy_implicit(self, a, b, c, d):
+        for i in range(len(self.members)):
+            self.members[i].Energy_implicit(a[i], b[i], c[i], d[i])
+    
+    def P(self, P, R, T, flx=None):
+        if flx is None:
+            flx=np.zeros_like(P)
+        for i in range(len(self.members)):
+            self.members[i].P(P[i], R, T[i], flx[i])
+        return flx
@@ -10,6 +10,8 @@
 This file contains classes for reading and writing files in proper format:
     -write input file with domain and solver settings
     -read input file as input to solver
+    -settings of each member of an ensemble run (several parameter sets
+    solved together)
 
 """
 
@@ -18,35 +20,102 @@ This file contains classes for reading and writing files in proper format:
 keys_Settings=['MPI_Processes', 'Length','Nodes_x','Model',\
                'k_s','k_model','Cv_s','rho_IC','Darcy_mu', \
                'Carmen_diam','Kozeny_const','Porosity', 'gas_constant',\
-               'diff_interpolation', 'conv_interpolation']
+               'diff_interpolation', 'conv_interpolation', 'Moving_window',\
+               'AMR']
 
 keys_mesh=['bias_type_x','bias_size_x']
 
-keys_Sources=['Source_Uniform','Source_Kim','Ea','A0','dH', 'Ignition', 'gas_gen']
+# Domain settings that may be left out of input file
+defaults_Settings={'Moving_window': 'None', 'AMR': 'None'}
+
+keys_Sources=['Source_Uniform','Source_Kim','Ea','A0','dH', 'Ignition', 'gas_gen',\
+              'Rate_table']
+
+# Source settings that may be left out of input file
+defaults_Sources={'Rate_table': 'None'}
 
 keys_Species=['Cv_g','Cp_g','k_g']
 
 keys_Time_adv=['Fo','dt','total_time_steps', 'total_time','Restart',\
-               'Time_Scheme','Convergence','Max_iterations','Number_Data_Output']
+               'Time_Scheme','Convergence','Max_iterations','Number_Data_Output',\
+               'Backend','Steps_per_call','Active_region','Speed_window','Lagged_dt',\
+               'Ghost_width','Load_balance','Output_format',\
+               'Async_output','Snapshot_codec','Checkpoint']
+
+# Settings that may be left out of input file
+defaults_Time_adv={'Backend': 'NumPy', 'Steps_per_call': 1, 'Active_region': 'None',\
+                   'Speed_window': 1000, 'Lagged_dt': 'False', 'Ghost_width': 1,\
+                   'Load_balance': 'None', 'Output_format': 'npy',\
+                   'Async_output': 'None', 'Snapshot_codec': 'None', 'Checkpoint': 'None'}
 
 keys_BCs=     ['bc_left_E','bc_right_E',\
               'bc_left_rad','bc_right_rad',\
               'bc_left_P','bc_right_P',\
               'bc_left_mass','bc_right_mass']
 
+# Settings that can have a value for each ensemble member (separated by ';')
+keys_Ensemble=['Porosity','Carmen_diam','Ea','A0','bc_left_E','bc_right_E']
+
 
 newline_check='\n' # This should be \n for Windows, \r for Ubuntu
 
 import string as st
+import os
+import copy
+
+# Value from input file; list of floats if values for each ensemble member given
+def member_values(key, value):
+    if key in keys_Ensemble and st.find(value, ';')>=0:
+        return [float(i) for i in st.split(value, ';')]
+    return float(value)
+
+# Number of ensemble members (1 if no per-member values given)
+# Returns 0 if per-member values do not all have the same number of values
+def ensemble_size(settings, Sources, BCs):
+    sizes=[]
+    for i in keys_Ensemble:
+        for dic in [settings, Sources]:
+            if i in dic and type(dic[i]) is list:
+                sizes.append(len(dic[i]))
+        if i in BCs:
+            for val in BCs[i]:
+                if type(val) is tuple:
+                    sizes+=[len(j) for j in val if type(j) is list]
+                elif type(val) is list:
+                    sizes.append(len(val))
+    if len(sizes)==0:
+        return 1
+    elif min(sizes)!=max(sizes):
+        return 0
+    return sizes[0]
+
+# Settings of ensemble member n (as input file of a single run)
+def ensemble_member(settings, Sources, BCs, n):
+    settings_n=copy.deepcopy(settings)
+    Sources_n=copy.deepcopy(Sources)
+    BCs_n=copy.deepcopy(BCs)
+    for i in keys_Ensemble:
+        for dic in [settings_n, Sources_n]:
+            if i in dic and type(dic[i]) is list:
+                dic[i]=dic[i][n]
+        if i in BCs_n:
+            BC=BCs_n[i]
+            for j in range(len(BC)):
+                if type(BC[j]) is tuple:
+                    BC[j]=tuple([(val[n] if type(val) is list else val) for val in BC[j]])
+                elif type(BC[j]) is list:
+                    BC[j]=BC[j][n]
+    settings_n['Members']=1
+    return settings_n, Sources_n, BCs_n
 
 class FileOut():
-    def __init__(self, filename, isBin):
+    def __init__(self, filename, isBin, directory='.'):
         self.name=filename
         if isBin:
             write_type='wb'
         else:
             write_type='w'
-        self.fout=open(filename+'.txt', write_type)
+        self.fout=open(os.path.join(directory, filename+'.txt'), write_type)
     
     # Write a single string with \n at end
     def Write_single_line(self, string):
@@ -162,6 +231,12 @@ class FileIn():
         self.fin=open(filename, read_type)
         
     def Read_Input(self, settings, Sources, Species, BCs):
+        for i in defaults_Time_adv:
+            settings[i]=defaults_Time_adv[i]
+        for i in defaults_Sources:
+            Sources[i]=defaults_Sources[i]
+        for i in defaults_Settings:
+            settings[i]=defaults_Settings[i]
         for line in self.fin:
             if st.find(line, ':')>0 and st.find(line, '#')!=0:
                 line=st.split(line, ':')
@@ -170,6 +245,9 @@ class FileIn():
                     # Integers
                     if line[0]=='Nodes_x':
                         settings[line[0]]=int(line[1])
+                    # Value for each ensemble member
+                    elif st.find(line[1], ';')>=0:
+                        settings[line[0]]=member_values(line[0], line[1])
                     
                     else:
                         try:
@@ -188,10 +266,11 @@ class FileIn():
                 elif line[0] in keys_Sources:
                     if st.find(line[1], 'None')>=0 or st.find(line[1], 'True')>=0\
                         or st.find(line[1], 'eta')>=0 or st.find(line[1], 'Temp')>=0\
-                        or st.find(line[1], 'rho')>=0 or st.find(line[1], 'vol')>=0:
+                        or st.find(line[1], 'rho')>=0 or st.find(line[1], 'vol')>=0\
+                        or line[0]=='Rate_table':
                         Sources[line[0]]=st.split(line[1], newline_check)[0]
                     else:
-                        Sources[line[0]]=float(line[1])
+                        Sources[line[0]]=member_values(line[0], line[1])
                 # Species info
                 elif line[0] in keys_Species:
                     try:
@@ -202,10 +281,15 @@ class FileIn():
                 # Time advancement details
                 elif line[0] in keys_Time_adv:
                     if line[0]=='Time_Scheme' or st.find(line[1], 'None')>=0 \
-                        or line[0]=='Restart':
+                        or line[0]=='Restart' or line[0]=='Backend'\
+                        or line[0]=='Active_region' or line[0]=='Lagged_dt'\
+                        or line[0]=='Output_format' or line[0]=='Snapshot_codec'\
+                        or line[0]=='Checkpoint':
                         settings[line[0]]=st.split(line[1], newline_check)[0]
                     elif line[0]=='total_time_steps' or line[0]=='Max_iterations'\
-                        or line[0]=='Number_Data_Output':
+                        or line[0]=='Number_Data_Output' or line[0]=='Steps_per_call'\
+                        or line[0]=='Speed_window' or line[0]=='Ghost_width'\
+                        or line[0]=='Load_balance' or line[0]=='Async_output':
                         settings[line[0]]=int(line[1])
                     elif line[0]=='Output_directory':
                         settings[line[0]]=line[1]+':'+st.split(line[2], newline_check)[0]
@@ -230,18 +314,19 @@ class FileIn():
                         del BC_info[0]
                         # Convective BC
                         if BCs[line[0]][3*i]=='C':
-                            BCs[line[0]]+=[(float(BC_info[0]),float(BC_info[1]))]
+                            BCs[line[0]]+=[(member_values(line[0], BC_info[0]),member_values(line[0], BC_info[1]))]
                             del BC_info[1], BC_info[0]
                             BCs[line[0]]+=[(int(BC_info[0]),int(BC_info[1]))]
                             del BC_info[1], BC_info[0]
                         # Constant value/flux of variable BCs
                         else:
-                            # Value into a float
-                            BCs[line[0]]+=[float(BC_info[0])]
+                            # Value into a float (or list for ensemble members)
+                            BCs[line[0]]+=[member_values(line[0], BC_info[0])]
                             del BC_info[0]
                             BCs[line[0]]+=[(int(BC_info[0]),int(BC_info[1]))]
                             del BC_info[1], BC_info[0]
                             
                         i+=1
                     
-        self.fin.close()
\ No newline at end of file
+        self.fin.close()
+        settings['Members']=ensemble_size(settings, Sources, BCs)
\ No newline at end of file
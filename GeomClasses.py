@@ -12,9 +12,23 @@ This file contains the 1D domain classes:
     -holds x coordinate arrays
     -holds dx discretization array
     -calculates thermal properties
-    -meshing function (biasing feature not functional in solver)
+    -meshing function
     -function to return temperature given conservative variable (energy)
     -calculate CV 'volume' at each node
+    -cached inverse CV widths and face spacings for solver
+    -ensemble runs: variables have leading axis for each member (members, nodes);
+    per-member settings are column arrays and mesh is shared
+    -active region: nodes above a temperature and not fully reacted (plus
+    margin); porosity/permeability only updated there (solid density only
+    changes by reaction, which solver limits to these nodes)
+    -moving window: domain follows reaction front (uniform mesh); burnt nodes
+    behind window archived for output, unreacted nodes added ahead
+    -adaptive mesh refinement: intervals of base mesh split in 2**level where
+    gradients of eta or temperature are large; conservative remap of variables
+    (integral over new CVs); intervals next to ghost nodes kept at base mesh
+    -ghost width: nodes of neighbouring processes held by each process (see
+    MPI_discretize)
+    -state for checkpoints (all attributes)
 
 Requires:
     -length of domain
@@ -37,9 +51,13 @@ class OneDimLine():
         self.dx=np.zeros(self.Nx) # NOTE: SIZE MADE TO MATCH REST OF ARRAYS (FOR NOW)
         self.rank=rank
         self.porosity_0=settings['Porosity']
+        self.members=settings['Members'] # Ensemble members
         
         # Variables for conservation equations
-        self.E=np.zeros(self.Nx) # Lumped energy
+        if self.members>1:
+            self.E=np.zeros((self.members, self.Nx)) # Lumped energy
+        else:
+            self.E=np.zeros(self.Nx) # Lumped energy
         self.max_iter=settings['Max_iterations']
         self.conv=settings['Convergence']
         
@@ -83,9 +101,62 @@ class OneDimLine():
         self.xbias=[settings['bias_type_x'], settings['bias_size_x']]
         self.isMeshed=False
         
+        # Active region; [temperature],[margin nodes] or None (all nodes)
+        self.active=None # Flat index of active nodes; None if all nodes
+        self.active_T=settings['Active_region']
+        if self.active_T!='None':
+            self.active_T,self.active_margin=st.split(self.active_T, ',')
+            self.active_T=float(self.active_T)
+            self.active_margin=int(self.active_margin)
+        self.active_eps=10**(-9) # Nodes with eta>1-active_eps have reacted
+        self.active_max=0.5 # All nodes used if active region is larger fraction
+        
+        # Moving window; front location (node) and nodes per shift or None
+        self.window=settings['Moving_window']
+        if self.window!='None':
+            loc,n=st.split(self.window, ',')
+            self.window=(int(float(loc)*(self.Nx-1)), int(n))
+        else:
+            self.window=None
+        self.archive={} # Burnt nodes left behind window (lists of arrays)
+        
+        # Adaptive mesh refinement; [levels],[eta gradient],[temperature gradient],
+        # [buffer intervals],[time steps between regrids] or None
+        self.amr=settings['AMR']
+        if self.amr!='None':
+            amr=st.split(self.amr, ',')
+            self.amr={'levels': int(amr[0]), 'eta': float(amr[1]), 'T': float(amr[2]),\
+                      'buffer': int(amr[3]), 'steps': int(amr[4])}
+        else:
+            self.amr=None
+        
         # MPI information (will be set by another function)
         self.proc_left=-1
         self.proc_right=-1
+        self.ghosts=settings['Ghost_width'] # Ghost nodes next to each process
+        
+    # Nodes owned by this process (ghost nodes excluded)
+    def owned(self):
+        n=self.E.shape[-1]
+        return slice(self.ghosts*(self.proc_left>=0), n-self.ghosts*(self.proc_right>=0))
+        
+    # Properties depend on temperature (k or Cv of solid, or of gas in species
+    # model, given for an element with Temp)
+    def T_dependent(self):
+        prop=[self.k, self.Cv]
+        if self.model=='Species':
+            prop+=[self.Cv_g, self.Cp_g, self.k_g]
+        for p in prop:
+            if type(p) is list and len(p)==2 and p[1]=='Temp':
+                return True
+        return False
+    
+    # State of domain (checkpoint); all attributes
+    def checkpoint_state(self):
+        return dict(self.__dict__)
+    
+    def restore_state(self, state):
+        self.__dict__.update(state)
         
     # Discretize domain and save dx and dy
     def mesh(self):
@@ -124,6 +195,7 @@ class OneDimLine():
             self.x[i+1]=self.x[i]+self.dx[i]
         
         self.X=self.x
+        self.hx=self.CV_dim()
         
         self.isMeshed=True
     
@@ -145,13 +217,196 @@ class OneDimLine():
             for i in range(len(self.species_keys)):
                 self.rho_species[self.species_keys[i]]=np.ones_like(self.E)\
                     *float(self.rho[i])*por[i]
-            self.rho_0=self.rho_species[self.species_keys[1]]
+            self.rho_0=self.rho_species[self.species_keys[1]].copy()
             self.perm=self.porosity**3*self.part_diam**2\
                 /(self.kozeny*(1-self.porosity)**2)
+        self.geom_cache()
+    
+    # Mesh quantities used every time step (local nodes, after MPI_discretize)
+    # Faces lie midway between nodes, so face interpolation weights are 0.5
+    def geom_cache(self):
+        self.inv_hx=1/self.hx # Inverse CV widths
+        self.inv_dx=1/(self.X[1:]-self.X[:-1]) # Inverse node spacing across each face
+        # Largest explicit Fourier number (based on hx) for stable diffusion:
+        # each CV needs Fo*min(hx**2)<=hx/(sum of inv_dx of its faces);
+        # never above 1 (uniform mesh gives 2, so limit is unchanged there)
+        s=np.zeros_like(self.hx)
+        s[1:]+=self.inv_dx
+        s[:-1]+=self.inv_dx
+        self.Fo_max=min(1.0, np.amin(self.hx/s)/np.amin(self.hx**2))
+        
+    # Find active nodes from latest temperature (T_guess) and progress
+    # Margin nodes added on either side within same row (ensemble member)
+    # All nodes active until T_guess is set (first calcProp)
+    def update_active(self):
+        if self.active_T=='None':
+            return
+        if not np.any(self.T_guess):
+            self.active=None
+            return
+        on=self.T_guess>=self.active_T
+        on&=self.eta<1-self.active_eps
+        ind=np.flatnonzero(on)
+        m=self.active_margin
+        if m>0 and len(ind)>0:
+            ind=ind.reshape(-1,1)+np.arange(-m, m+1)
+            n=np.shape(on)[-1]
+            if self.members>1:
+                ind=ind[ind//n==ind[:,m:m+1]//n]
+            else:
+                ind=ind[(ind>=0)&(ind<n)]
+            on.flat[ind]=True
+            ind=np.flatnonzero(on)
+        if len(ind)>self.active_max*on.size:
+            self.active=None
+        else:
+            self.active=ind
+    
+    # Values at active nodes (array, or scalar/column setting)
+    def at_active(self, var):
+        if np.size(var)==1:
+            return var
+        elif np.shape(var)==np.shape(self.eta):
+            return var.take(self.active)
+        return np.broadcast_to(var, np.shape(self.eta)).flat[self.active]
+    
+    # Variables at nodes moved with window (state and properties kept between steps)
+    def window_vars(self):
+        var=[('E', self.E), ('eta', self.eta), ('T_guess', self.T_guess),\
+             ('porosity', self.porosity), ('P', self.P), ('rho_0', self.rho_0)]
+        if self.model=='Species':
+            var.append(('perm', self.perm))
+            for i in self.species_keys:
+                var.append(('rho_'+i, self.rho_species[i]))
+        return var
+    
+    # Start moving window; new nodes take initial state of right node
+    def init_window(self):
+        self.window_new={}
+        for name,dat in self.window_vars():
+            self.window_new[name]=dat[-1]
+        self.archive={'X': [], 'T': []}
+        for name in ['eta','P']+['rho_'+i for i in getattr(self, 'species_keys', [])]:
+            self.archive[name]=[]
+    
+    # Move window n nodes in +x direction (arrays shifted in place); nodes left
+    # behind archived with latest temperature (T_guess); properties are not
+    # recomputed as new nodes take initial T_guess, porosity and permeability
+    def shift_window(self, n):
+        self.archive['X'].append(self.X[:n].copy())
+        self.archive['T'].append(self.T_guess[:n].copy())
+        for name,dat in self.window_vars():
+            if name in self.archive:
+                self.archive[name].append(dat[:n].copy())
+            dat[:-n]=dat[n:]
+            dat[-n:]=self.window_new[name]
+        self.X+=n*self.dx[0]
+    
+    # Start mesh refinement; current (local) nodes are base mesh
+    def init_amr(self):
+        self.X_base=self.X.copy()
+        self.level=np.zeros(len(self.X)-1, dtype=int) # Level of each base interval
+    
+    # Refinement level of each base interval; intervals where gradient of eta
+    # or temperature (T_guess) exceeds its threshold get highest level,
+    # buffer intervals either side, then levels of neighbours differ by 1 or less
+    def amr_levels(self):
+        a=self.amr
+        inv_dx=1/(self.X[1:]-self.X[:-1])
+        flag=np.abs(np.diff(self.eta, axis=-1))*inv_dx>a['eta']
+        flag|=np.abs(np.diff(self.T_guess, axis=-1))*inv_dx>a['T']
+        if self.members>1:
+            flag=np.any(flag, axis=0)
+        base=np.searchsorted(self.X_base, self.X[:-1], side='right')-1
+        lev=np.zeros(len(self.X_base)-1, dtype=int)
+        lev[base[flag]]=a['levels']
+        for i in range(a['buffer']):
+            l=lev.copy()
+            np.maximum(lev[1:], l[:-1], out=lev[1:])
+            np.maximum(lev[:-1], l[1:], out=lev[:-1])
+        for i in range(a['levels']):
+            l=lev-1
+            np.maximum(lev[1:], l[:-1], out=lev[1:])
+            np.maximum(lev[:-1], l[1:], out=lev[:-1])
+        # Levels rise from 0 at intervals next to ghost nodes (other processes)
+        ind=np.arange(len(lev))
+        if self.proc_left>=0:
+            np.minimum(lev, ind, out=lev)
+        if self.proc_right>=0:
+            np.minimum(lev, ind[::-1], out=lev)
+        return lev
+    
+    # Variables remapped to new mesh (state and properties kept between steps)
+    def amr_vars(self):
+        var=[('E', self.E), ('eta', self.eta), ('T_guess', self.T_guess),\
+             ('porosity', self.porosity), ('P', self.P), ('rho_0', self.rho_0)]
+        if self.model=='Species':
+            for i in self.species_keys:
+                var.append(('rho_'+i, self.rho_species[i]))
+        return var
+    
+    # Remap u conservatively from CVs with faces f_old to CVs with faces f_new
+    # (u constant in each CV)
+    def remap(self, u, f_old, f_new):
+        U=np.zeros(np.shape(u)[:-1]+(len(f_old),))
+        np.cumsum(u*np.diff(f_old), axis=-1, out=U[...,1:])
+        if U.ndim>1:
+            U=np.array([np.interp(f_new, f_old, row) for row in U])
+        else:
+            U=np.interp(f_new, f_old, U)
+        return np.diff(U, axis=-1)/np.diff(f_new)
+    
+    # Refine/coarsen base intervals to levels from amr_levels and remap variables
+    # Returns True if mesh changed
+    def regrid(self):
+        lev=self.amr_levels()
+        if np.array_equal(lev, self.level):
+            return False
+        self.level=lev
         
+        # New nodes; base interval j split into 2**lev[j] intervals
+        n=2**lev
+        j=np.repeat(np.arange(len(lev)), n)
+        frac=(np.arange(len(j))-np.repeat(np.cumsum(n)-n, n))/np.repeat(n, n).astype(float)
+        X=self.X_base[j]+(self.X_base[j+1]-self.X_base[j])*frac
+        X=np.append(X, self.X_base[-1])
+        
+        # CV faces (midway between nodes; boundary nodes have half CVs)
+        f_old=np.concatenate(([self.X[0]], 0.5*(self.X[1:]+self.X[:-1]), [self.X[-1]]))
+        f_new=np.concatenate(([X[0]], 0.5*(X[1:]+X[:-1]), [X[-1]]))
+        for name,dat in self.amr_vars():
+            dat=self.remap(dat, f_old, f_new)
+            if name[4:] in self.rho_species:
+                self.rho_species[name[4:]]=dat
+            else:
+                setattr(self, name, dat)
+        np.clip(self.eta, 0, 1, out=self.eta) # Round-off of fully reacted CVs
+        
+        # Mesh quantities; ghost nodes keep CV width of their process
+        hx=np.diff(f_new)
+        if self.proc_left>=0:
+            hx[0]=self.hx[0]
+        if self.proc_right>=0:
+            hx[-1]=self.hx[-1]
+        self.X=X
+        self.dx=np.append(np.diff(X), X[-1]-X[-2])
+        self.hx=hx
+        self.geom_cache()
+        self.active=None
+        if self.model=='Species':
+            self.calc_porosity()
+        return True
+    
+    # Porosity and permeability from solid density (all nodes)
+    def calc_porosity(self):
+        self.porosity=self.porosity_0+\
+            (1-self.rho_species[self.species_keys[1]]/self.rho_0)*(1-self.porosity_0)
+        self.perm=self.porosity**3*self.part_diam**2\
+            /(self.kozeny*(1-self.porosity)**2)
+    
     # Calculate and return dimensions of CV
     def CV_dim(self):
-        hx=np.zeros_like(self.E)
+        hx=np.zeros_like(self.x)
         
         hx[0]      =0.5*(self.dx[0])
         hx[1:-1]   =0.5*(self.dx[1:-1]+self.dx[:-2])
@@ -208,10 +463,15 @@ class OneDimLine():
         if self.model=='Species':
             k_g=np.zeros_like(self.eta)
             # Changing porosity/permeability
-            self.porosity=self.porosity_0+\
-                (1-self.rho_species[self.species_keys[1]]/self.rho_0)*(1-self.porosity_0)
-            self.perm=self.porosity**3*self.part_diam**2\
-                /(self.kozeny*(1-self.porosity)**2)
+            if self.active is None:
+                self.calc_porosity()
+            else:
+                por_0=self.at_active(self.porosity_0)
+                por=por_0+(1-self.at_active(self.rho_species[self.species_keys[1]])\
+                           /self.at_active(self.rho_0))*(1-por_0)
+                self.porosity.flat[self.active]=por
+                self.perm.flat[self.active]=por**3*self.at_active(self.part_diam)**2\
+                    /(self.kozeny*(1-por)**2)
             
             # Heat capacity of Solid phase
             rhoC=self.rho_species[self.species_keys[1]]*Cv
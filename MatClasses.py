@@ -154,7 +154,6 @@ class Cp():
         
     def Air(self, T, typ):
         molar_mass=28.97
-        Cp=np.zeros_like(T)
         
 #        # Coefficicents for polynomial fit (273-1800 K)
 #        # Taken from Cengel and Boles, Thermodynamics: An engineering approach
@@ -173,7 +172,15 @@ class Cp():
         a3=-6.6196e-7
         a4=1.4070e-10
         
-        Cp=a0+a1*T+a2*T**2+a3*T**3+a4*T**4
+        # Horner form evaluated in place (one array)
+        Cp=a4*T
+        Cp+=a3
+        Cp*=T
+        Cp+=a2
+        Cp*=T
+        Cp+=a1
+        Cp*=T
+        Cp+=a0
         
         if typ=='Cp':
             return Cp
@@ -182,7 +189,6 @@ class Cp():
         
     def O2(self, T, typ):
         molar_mass=15.99*2
-        Cp=np.zeros_like(T)
         
         # Coefficicents for polynomial fit (298 to 6000 K)
         # Excel regression of JANAF data
@@ -192,7 +198,16 @@ class Cp():
         a3=6.6386e-10
         a4=-4.1567e-14
         
-        Cp=(a0+a1*T+a2*T**2+a3*T**3+a4*T**4)*1000/molar_mass
+        # Horner form evaluated in place (one array)
+        Cp=a4*T
+        Cp+=a3
+        Cp*=T
+        Cp+=a2
+        Cp*=T
+        Cp+=a1
+        Cp*=T
+        Cp+=a0
+        Cp*=1000/molar_mass
         
         if typ=='Cp':
             return Cp
@@ -11,8 +11,9 @@ This file contains the post-processing script for 1D conduction:
         python Post-processing.py [Data directory relative to current directory]
     -Reads input file to get necessary parameters
     -Reads x meshgrid array (.npy) for graph output
-    -Reads variable arrays (.npy files) and outputs graphs (.png) for 
-    each time step in directory
+    -Reads variable arrays (.npy or encoded .snp files, snapshot container or
+    store) and outputs
+    graphs (.png) for each time step in directory
 
 Features:
     -Graphs of Temperature, reaction progress, reaction rate
@@ -29,6 +30,9 @@ import sys
 import string as st
 from matplotlib import pyplot
 from FileClasses import FileIn
+from Source_Comb import Source_terms
+import snapshots
+import snapshot_codec
 
 pyplot.ioff()
 
@@ -117,6 +121,7 @@ sources={}
 Species={}
 BCs={}
 input_file.Read_Input(settings, sources, Species, BCs)
+source=Source_terms(sources['Ea'], sources['A0'], sources['dH'], sources['gas_gen'], sources['Rate_table'])
 xmax=float(settings['Length'])*1000
 try:
     settings['rho_IC']=st.split(settings['rho_IC'], ',')
@@ -126,18 +131,38 @@ except:
 ##############################################################
 #               Times to process (if ALL is selected)
 ##############################################################
-if type(times) is str:
+# Snapshot container/store; records by time (ms, as in data file names)
+records=None
+if settings['Output_format']!='npy':
+    records=snapshots.read_index()
+    records=dict((rec['time'], rec) for rec in records)
+    if type(times) is str:
+        times=sorted(records.keys(), key=float)
+elif type(times) is str:
     times=os.listdir('.')
     i=len(times)
     j=0
     while i>j:
-        if st.find(times[j],'T')==0 and st.find(times[j],'.npy')>0:
-            times[j]=st.split(st.split(times[j],'_')[1],'.npy')[0]
+        if st.find(times[j],'T')==0 and (st.find(times[j],'.npy')>0 \
+            or st.find(times[j],snapshot_codec.ext)>0):
+            times[j]=os.path.splitext(st.split(times[j],'_')[1])[0]
             j+=1
         else:
             del times[j]
             i-=1
 
+# Variable saved at given time (.npy file or record in container/store); None
+# if not saved
+def load(name, time):
+    if records is not None:
+        return snapshots.read_var(records[time], name)
+    # Encoded with snapshot codec
+    if os.path.isfile(name+'_'+time+snapshot_codec.ext):
+        return snapshot_codec.load(name+'_'+time+snapshot_codec.ext)
+    if not os.path.isfile(name+'_'+time+'.npy'):
+        return None
+    return np.load(name+'_'+time+'.npy', False)
+
 ##############################################################
 #               Figure details (NOT USED)
 ##############################################################
@@ -145,11 +170,17 @@ if type(times) is str:
 ##############################################################
 #               Generate graphs
 ##############################################################
-X=np.load('X.npy', False)
+X_run=np.load('X.npy', False)
 for time in times:
-    T=np.load('T_'+time+'.npy', False)
+    # x array of each output for moving window
+    X=load('X', time)
+    if X is None:
+        X=X_run
+    else:
+        xmax=X[-1]*1000
+    T=load('T', time)
     if st.find(sources['Source_Kim'],'True')>=0:
-        eta=np.load('eta_'+time+'.npy', False)
+        eta=load('eta', time)
         Y_tot=0.0
     
     # 1D temperature profile at centreline
@@ -176,7 +207,7 @@ for time in times:
         
         # Reaction rate contour
         if st.find(Phi_graphs,'True')>=0:
-            phi=sources['A0']*(1-eta)*np.exp(-sources['Ea']/8.314/T)
+            phi=source.Source_Comb_Kim_rate(0, T, eta)[1]
             fig=pyplot.figure(figsize=(6, 6))
             pyplot.plot(X*1000, phi)
             pyplot.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
@@ -188,7 +219,9 @@ for time in times:
             pyplot.close(fig)
     try:
         # Pressure plot
-        P=np.load('P_'+time+'.npy', False)
+        P=load('P', time)
+        if P is None:
+            raise IOError('Pressure not saved at '+time)
         fig=pyplot.figure(figsize=(6, 6))
         pyplot.plot(X*1000,P)
         pyplot.xlabel('$x$ (mm)')
@@ -203,7 +236,7 @@ for time in times:
     
         # Mass fraction contours
     for i in range(len(titles)):
-        Y_0=np.load('rho_'+titles[i]+'_'+time+'.npy', False)
+        Y_0=load('rho_'+titles[i], time)
         fig=pyplot.figure(figsize=(6, 6))
         pyplot.plot(X*1000,Y_0)
         pyplot.xlabel('$x$ (mm)')
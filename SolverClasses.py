@@ -16,19 +16,55 @@ Heat Conduction:
 
 Features/assumptions:
     -time step based on Fourrier number and local discretizations in x
-    -equal node spacing in x
+    -implicit or Crank-Nicolson heat diffusion (tridiagonal system partitioned
+    over processes; only first and last values of each process gathered)
+    -right hand side of conservation equations integrated by Runge-Kutta
+    schemes in temporal_schemes.py (Explicit is forward Euler)
+    -Strang splitting; reaction integrated separately in substeps (Source_Comb.py)
+    so time step is limited by transport only
+    -stage, rate and flux buffers for time step preallocated once (Workspace);
+    state arrays swapped with new state at end of each step rather than copied
+    -properties (calcProp), Kim rate and implicit solve still allocate their
+    results each call
+    -node spacing in x can vary (mesh quantities cached by geometry object)
     -thermal properties can vary in space (call from geometry object)
     -Radiation boundary conditions
+    -ensemble runs; variables of all members (members, nodes) advanced
+    together with one time step (smallest of all members)
+    -adaptive mesh refinement; buffers rebuilt when mesh changes (time step
+    limited by smallest CV)
 
 """
 
 import numpy as np
-import copy
 import string as st
 import Source_Comb
 import BCClasses
+import mpi_routines
+import temporal_schemes
+import jit_kernels
 from mpi4py import MPI
 
+# Preallocated stage, rate and flux buffers for time advancement (created once)
+class Workspace():
+    def __init__(self, y, Nk):
+        n=y[0].shape # (members, nodes) for ensemble runs
+        n_f=n[:-1]+(n[-1]-1,)
+        # State buffers; y_new swapped with state at end of each step
+        self.y_new=[np.zeros_like(var) for var in y]
+        self.y_stage=[np.zeros_like(var) for var in y]
+        self.dydt=[[np.zeros_like(var) for var in y] for i in range(Nk)]
+        # Node buffers
+        self.cell=np.zeros(n)
+        self.P=np.zeros(n)
+        self.m_BC=np.zeros(n)
+        self.E_BC=np.zeros(n)
+        # Face buffers (n-1 faces)
+        self.face=np.zeros(n_f)
+        self.flux=np.zeros(n_f)
+        self.mflux=np.zeros(n_f)
+        self.tmp=np.zeros(n_f)
+
 # 2D solver (Cartesian coordinates)
 class OneDimLineSolve():
     def __init__(self, geom_obj, settings, Sources, BCs, solver, size, comm):
@@ -45,15 +81,60 @@ class OneDimLineSolve():
         self.diff_inter=settings['diff_interpolation']
         self.conv_inter=settings['conv_interpolation']
         
+        # Implicit weighting of diffusion term (0-explicit, 0.5-Crank-Nicolson, 1-backward Euler)
+        self.theta=0
+        if self.time_scheme=='Implicit':
+            self.theta=1.0
+        elif self.time_scheme=='Crank_Nicolson':
+            self.theta=0.5
+        # Properties depend on temperature; implicit solve iterated on them
+        self.T_dep=geom_obj.T_dependent()
+        # Source terms solved separately from transport (operator splitting)
+        self.split=self.time_scheme=='Strang_split'
+        # Runge-Kutta scheme for explicit terms (method of lines)
+        if self.time_scheme in ['Explicit','Implicit','Crank_Nicolson','Strang_split']:
+            self.RK=temporal_schemes.runge_kutta('Euler')
+        else:
+            self.RK=temporal_schemes.runge_kutta(self.time_scheme)
+        self.ws=None # Workspace for time advancement; allocated on first time step
+        # Adaptive time step controller (embedded pairs); tolerance is 'Convergence'
+        # and 'Max_iterations' limits rejected steps
+        self.dt_next=None
+        self.err_prev=1.0
+        self.safety=0.9
+        self.facmin=0.2
+        self.facmax=5.0
+        # Compiled (Numba) backend for explicit time steps; several steps per call
+        # on one process only (ghost nodes exchanged every step)
+        self.backend=settings['Backend']
+        self.steps_call=settings['Steps_per_call']
+        if size>1:
+            self.steps_call=1
+        self.nt_taken=1 # Time steps taken in last call to Advance_Soln_Cond
+        self.jit=None # Kernel settings/buffers; set up on first time step
+        # Time step lagged by one step (multiple processes); smallest time step
+        # of all processes found with error code and ignition at end of step
+        # Not with adaptive mesh (lagged time step may be from coarser mesh)
+        self.lag=settings['Lagged_dt']=='True' and size>1 and geom_obj.amr is None
+        self.dt_lag=None # Time step agreed at end of last step
+        self.dt_local=np.inf # Time step of this process for next reduction
+        # Attributes changed during run (saved in checkpoints)
+        self.state_names=['Fo','dt_next','err_prev','backend','nt_taken','dt_lag','dt_local']
+        # MPI routines needed for ghost nodes
+        self.mpi=mpi_routines.MPI_comms(comm, self.rank, size, Sources, {})
+        
         # Define source terms and pointer to source object here
-        self.get_source=Source_Comb.Source_terms(Sources['Ea'], Sources['A0'], Sources['dH'], Sources['gas_gen'])
+        self.get_source=Source_Comb.Source_terms(Sources['Ea'], Sources['A0'], Sources['dH'], Sources['gas_gen'], Sources['Rate_table'])
         self.source_unif=Sources['Source_Uniform']
         self.source_Kim=Sources['Source_Kim']
         self.ign=st.split(Sources['Ignition'], ',')
         self.ign[1]=float(self.ign[1])
         
-        # BC class
-        self.BCs=BCClasses.BCs(BCs, self.dx)
+        # BC class (list of BCs for each member of ensemble)
+        if type(BCs) is list:
+            self.BCs=BCClasses.Ensemble_BCs(BCs, self.dx)
+        else:
+            self.BCs=BCClasses.BCs(BCs, self.dx)
         # Modify BCs if no process is next to current one
         if self.Domain.proc_left>=0:
             self.BCs.BCs['bc_left_E']=['F', 0.0, (0, -1)]
@@ -65,176 +146,709 @@ class OneDimLineSolve():
     # Time step check with dx, dy, Fo number
     def getdt(self, k, rhoC, h):
         # Stability check for Fourrier number
-        if self.time_scheme=='Explicit':
-            self.Fo=min(self.Fo, 1.0)
+        # (limit changes with adaptive mesh, so Fo setting is kept)
+        Fo=self.Fo
+        if self.theta==0:
+            Fo=min(self.Fo, self.Domain.Fo_max)
         elif self.Fo=='None':
-            self.Fo=1.0
+            Fo=1.0
+        
+        # Nodes owned by this process (ghost nodes may be out of date)
+        own=self.Domain.owned()
+        dt=Fo*rhoC/k*(h)**2
+        dt=np.amin(dt[...,own])
         
-        dt=self.Fo*rhoC/k*(h)**2
-        return np.amin(dt)
+        # Darcy flow of gas (explicit); pressure diffuses with perm*P/mu
+        # Stability limit of explicit diffusion (not scaled by Fo)
+        if self.Domain.model=='Species':
+            d=self.Domain
+            D=d.rho_species[d.species_keys[0]]/d.porosity*d.R*(d.E/rhoC)
+            D*=d.perm/d.mu/h**2
+            D=np.amax(D[...,own])
+            if D>0:
+                dt=min(dt, 0.5/D)
+        return dt
     
-    # Interpolation function
-    def interpolate(self, k1, k2, func):
+    # Interpolation function; result put in out (with tmp as scratch) if given
+    def interpolate(self, k1, k2, func, out=None, tmp=None):
+        if out is None:
+            if func=='Linear':
+                return 0.5*k1+0.5*k2
+            else:
+                return 2*k1*k2/(k1+k2)
         if func=='Linear':
-            return 0.5*k1+0.5*k2
+            np.multiply(k1, 0.5, out=out)
+            np.multiply(k2, 0.5, out=tmp)
+            out+=tmp
+        else:
+            np.multiply(k1, 2, out=out)
+            out*=k2
+            np.add(k1, k2, out=tmp)
+            out/=tmp
+        return out
+    
+    # Tridiagonal matrix algorithm (Thomas); a-lower, b-main, c-upper diagonals
+    # Along first axis (ensemble members or right hand sides along second axis)
+    def TDMA(self, a, b, c, d):
+        n=len(d)
+        c_p=np.zeros_like(d)
+        d_p=np.zeros_like(d)
+        x=np.zeros_like(d)
+        c_p[0]=c[0]/b[0]
+        d_p[0]=d[0]/b[0]
+        for i in range(1,n):
+            m=b[i]-a[i]*c_p[i-1]
+            c_p[i]=c[i]/m
+            d_p[i]=(d[i]-a[i]*d_p[i-1])/m
+        x[-1]=d_p[-1]
+        for i in range(n-2,-1,-1):
+            x[i]=d_p[i]-c_p[i]*x[i+1]
+        
+        return x
+    
+    # Solve tridiagonal system spread across all processes (partitioned)
+    # Each process solves its own block for its right hand side and for the
+    # couplings to last node of left neighbour and first node of right
+    # neighbour (3 right hand sides, one sweep). First and last values of all
+    # blocks then found from reduced system (2 unknowns per process) gathered
+    # in one small collective; ghost node (1) is value of neighbour
+    def solve_tridiag(self, a, b, c, d):
+        if self.size==1:
+            return self.TDMA(a.T, b.T, c.T, d.T).T
+        own=self.Domain.owned()
+        left,right=self.Domain.proc_left>=0,self.Domain.proc_right>=0
+        rhs=np.zeros((len(d[own]),3))
+        rhs[:,0]=d[own]
+        if left:
+            rhs[0,1]=-a[own][0]
+        if right:
+            rhs[-1,2]=-c[own][-1]
+        y=self.TDMA(a[own], b[own], c[own], rhs)
+        
+        # Reduced system; unknowns are first and last value of each block
+        ends=np.empty((self.size,2,3))
+        t=MPI.Wtime()
+        self.comm.Allgather(np.ascontiguousarray(y[[0,-1]]), ends)
+        self.mpi.time_wait+=MPI.Wtime()-t
+        n=2*self.size
+        M=np.identity(n)
+        for p in range(self.size):
+            for i in range(2):
+                if p>0:
+                    M[2*p+i,2*p-1]=-ends[p,i,1]
+                if p<self.size-1:
+                    M[2*p+i,2*p+2]=-ends[p,i,2]
+        u=np.linalg.solve(M, ends[:,:,0].ravel())
+        
+        # Values of neighbours and solution of this process
+        x_l,x_r=0,0
+        if left:
+            x_l=u[2*self.rank-1]
+        if right:
+            x_r=u[2*self.rank+2]
+        x=np.empty_like(d)
+        x[own]=y[:,0]+x_l*y[:,1]+x_r*y[:,2]
+        if left:
+            x[0]=x_l
+        if right:
+            x[-1]=x_r
+        return x
+    
+    # Implicit portion of heat diffusion (theta method)
+    # Domain.E holds all explicit contributions on entry; returns number of iterations
+    def Solve_Diff_Implicit(self, T_c, dt):
+        E_exp=self.Domain.E.copy()
+        T=T_c.copy()
+        a=np.zeros_like(T)
+        c=np.zeros_like(T)
+        count,conv=0,1.0
+        # Iterate on temperature dependent properties (one solve if constant)
+        while count==0 or (self.T_dep and conv>self.conv and count<self.countmax):
+            T_prev=T
+            T_dum, k, rhoC, Cp=self.Domain.calcProp(T_guess=T_prev)
+            
+            # Face coefficients
+            D=self.theta*self.interpolate(k[...,1:],k[...,:-1], self.diff_inter)*self.Domain.inv_dx
+            a[...,1:]=-dt*self.Domain.inv_hx[1:]*D
+            c[...,:-1]=-dt*self.Domain.inv_hx[:-1]*D
+            b=rhoC-a-c
+            d=E_exp.copy()
+            self.BCs.Energy_implicit(a, b, c, d)
+            
+            T=self.solve_tridiag(a, b, c, d)
+            
+            # Convergence based on all processes
+            conv=np.amax(np.abs(T-T_prev)/T)
+            if self.size>1:
+                conv=self.mpi.max_all(np.array([conv]))[0]
+            count+=1
+        
+        self.Domain.E[:]=rhoC*T
+        return count
+        
+    # Collect state variables of domain (energy, reaction progress, species densities)
+    def get_state(self):
+        y=[self.Domain.E, self.Domain.eta]
+        if self.Domain.model=='Species':
+            for i in self.Domain.species_keys:
+                y.append(self.Domain.rho_species[i])
+        return y
+    
+    # Point domain state variables to given arrays
+    def set_state(self, y):
+        self.Domain.E=y[0]
+        self.Domain.eta=y[1]
+        if self.Domain.model=='Species':
+            for i in range(len(self.Domain.species_keys)):
+                self.Domain.rho_species[self.Domain.species_keys[i]]=y[2+i]
+    
+    # Allocate workspace for time advancement (once per run)
+    def create_buffers(self, y):
+        self.ws=Workspace(y, self.RK.Nk)
+    
+    # Add divergence of face flux to rate of nodes; flux is positive in +x direction
+    # Scatters flux/hx to nodes on either side of each face
+    def flux_div(self, dydt, flux):
+        ws=self.ws
+        np.multiply(flux, self.Domain.inv_hx[1:], out=ws.tmp)
+        dydt[...,1:]+=ws.tmp
+        np.multiply(flux, self.Domain.inv_hx[:-1], out=ws.tmp)
+        dydt[...,:-1]-=ws.tmp
+    
+    # Darcy mass flux at faces (in +x direction); put in out
+    def Darcy_flux(self, rho_g, P, out):
+        ws=self.ws
+        self.interpolate(self.Domain.perm[...,1:], self.Domain.perm[...,:-1], self.diff_inter, ws.face, ws.tmp)
+        np.negative(ws.face, out=ws.face)
+        ws.face/=self.Domain.mu
+        np.subtract(P[...,1:], P[...,:-1], out=ws.tmp)
+        ws.face*=ws.tmp
+        ws.face*=self.Domain.inv_dx
+        self.interpolate(rho_g[...,1:], rho_g[...,:-1], self.conv_inter, out, ws.tmp)
+        out*=ws.face
+        return out
+    
+    # Right hand side of conservation equations (method of lines)
+    # Fills dydt with rates of change of the state y; returns properties of state
+    # State is pointed to by domain to calculate properties
+    def RHS(self, y, dydt, props=None, diff_wt=1.0, reaction=True, transport=True):
+        ws=self.ws
+        self.set_state(y)
+        if props is None:
+            props=self.Domain.calcProp(self.Domain.T_guess)
+        T_c, k, rhoC, Cp=props
+        for var in dydt:
+            var[:]=0
+        
+        ###################################################################
+        # Source terms
+        ###################################################################
+        if reaction:
+            if self.source_unif!='None':
+                dydt[0]+=self.source_unif
+            if self.source_Kim=='True' or self.Domain.model=='Species':
+                E_kim, deta =self.get_source.Source_Comb_Kim_rate(self.Domain.rho_0, T_c, y[1], self.Domain.active)
+                dydt[0]+=E_kim
+                dydt[1]+=deta
+                if self.Domain.model=='Species':
+                    dm0,dm1=self.get_source.Source_mass(deta, self.Domain.porosity, self.Domain.rho_0)
+                    dydt[2]+=dm0
+                    dydt[3]-=dm1
+        
+        if not transport:
+            return props
+        
+        ###################################################################
+        # Conservation of Mass
+        ###################################################################
+        if self.Domain.model=='Species':
+            rho_g=y[2]
+            
+            # Calculate pressure
+            np.divide(rho_g, self.Domain.porosity, out=ws.P)
+            ws.P*=self.Domain.R
+            ws.P*=T_c
+            self.Domain.P=ws.P
+            
+            # Use Darcy's law to directly calculate the velocities at the faces
+            # Face mass flux kept in workspace for energy advection
+            self.Darcy_flux(rho_g, ws.P, ws.mflux)
+            self.flux_div(dydt[2], ws.mflux)
+        
+        ###################################################################
+        # Conservation of Energy
+        ###################################################################
+        # Face energy flux; one divergence for advection and conduction
+        if self.Domain.model=='Species':
+            # Porous medium advection (enthalpy carried by Darcy mass flux)
+            self.interpolate(Cp[...,1:], Cp[...,:-1], self.conv_inter, ws.flux, ws.tmp)
+            ws.flux*=ws.mflux
+            self.interpolate(T_c[...,1:], T_c[...,:-1], self.conv_inter, ws.face, ws.tmp)
+            ws.flux*=ws.face
         else:
-            return 2*k1*k2/(k1+k2)
+            ws.flux[:]=0
+        
+        # Heat diffusion (explicit portion); down the temperature gradient
+        if diff_wt>0:
+            self.interpolate(k[...,1:], k[...,:-1], self.diff_inter, ws.face, ws.tmp)
+            np.subtract(T_c[...,1:], T_c[...,:-1], out=ws.tmp)
+            ws.face*=ws.tmp
+            ws.face*=self.Domain.inv_dx
+            ws.face*=-diff_wt
+            ws.flux+=ws.face
+        self.flux_div(dydt[0], ws.flux)
+        
+        # Boundary conditions
+        self.BCs.Energy_rate(dydt[0], T_c, self.Domain.hx)
+        
+        return props
+    
+    # Pressure BCs; mass flux removed from boundary nodes (not a rate)
+    # Must be called after RHS has calculated pressure at beginning of step
+    def P_BCs(self, T_c, Cp):
+        ws=self.ws
+        self.BCs.P(self.Domain.P, self.Domain.R, T_c, flx=ws.m_BC)
+        np.multiply(ws.m_BC, Cp, out=ws.E_BC)
+        ws.E_BC*=T_c
+        ws.m_BC*=self.Domain.porosity
+        return ws.m_BC, ws.E_BC
+    
+    # Runge-Kutta time advancement of state y (Explicit is forward Euler)
+    # y is left unchanged; new state is put in workspace (y_new) and pointed to by domain
+    def Runge_Kutta(self, y, dt, props):
+        ws=self.ws
+        T_c, k, rhoC, Cp=props
+        self.RHS(y, ws.dydt[0], props, diff_wt=1-self.theta, reaction=not self.split)
+        if self.Domain.model=='Species':
+            m_BC, E_BC=self.P_BCs(T_c, Cp)
         
+        # Intermediate stages
+        for i in range(1,self.RK.Nk):
+            for j in range(len(y)):
+                ws.y_stage[j][:]=y[j]
+                for m in range(i):
+                    if self.RK.rk_coeff[i][m]!=0:
+                        np.multiply(ws.dydt[m][j], dt*self.RK.rk_coeff[i][m], out=ws.cell)
+                        ws.y_stage[j]+=ws.cell
+            self.set_state(ws.y_stage)
+            # Stage values at ghost nodes (Ghost_width is 1 with several stages)
+            self.mpi.update_ghosts(self.Domain)
+            self.RHS(ws.y_stage, ws.dydt[i], diff_wt=1-self.theta, reaction=not self.split)
+        
+        # Combine stages into new state
+        y_new=ws.y_new
+        for j in range(len(y)):
+            y_new[j][:]=y[j]
+            for m in range(self.RK.Nk):
+                if self.RK.rk_substep_fraction[m]!=0:
+                    np.multiply(ws.dydt[m][j], dt*self.RK.rk_substep_fraction[m], out=ws.cell)
+                    y_new[j]+=ws.cell
+        self.set_state(y_new)
+        
+        if self.Domain.model=='Species':
+            y_new[2]+=m_BC
+            y_new[0]+=E_BC
+        self.BCs.Energy_fixed(y_new[0], rhoC)
+        
+        # Heat diffusion (implicit portion)
+        if self.theta>0:
+            self.Solve_Diff_Implicit(T_c, dt)
+    
+    # Scaled error of embedded Runge-Kutta pair on nodes owned by this process
+    # Uses stage buffer for error estimate (stages are complete); y is state
+    # at beginning of step, y_new at end
+    def error_norm(self, y, y_new, dt):
+        ws=self.ws
+        # Ghost nodes excluded
+        own=self.Domain.owned()
+        sc=ws.cell[...,own]
+        
+        err=0
+        for j in range(len(y)):
+            ws.y_stage[j][:]=0
+            for m in range(self.RK.Nk):
+                if self.RK.rk_error_fraction[m]!=0:
+                    np.multiply(ws.dydt[m][j], dt*self.RK.rk_error_fraction[m], out=ws.cell)
+                    ws.y_stage[j]+=ws.cell
+            # Mixed relative/absolute scale; reaction progress scaled by 1
+            if j==1:
+                ref=1.0
+            else:
+                ref=max(np.amax(np.abs(y_new[j][...,own])), np.amax(np.abs(y[j][...,own])))
+            if ref>0:
+                np.abs(y_new[j][...,own], out=sc)
+                sc+=ref
+                sc*=self.conv
+                np.abs(ws.y_stage[j][...,own], out=ws.y_stage[j][...,own])
+                np.divide(ws.y_stage[j][...,own], sc, out=sc)
+                err=max(err, np.amax(sc))
+        
+        return err
+    
+    # Adaptive time step with embedded Runge-Kutta pair
+    # Steps with scaled error above 1 are rejected and repeated with smaller dt
+    # Returns time step taken and error code
+    def Runge_Kutta_adaptive(self, y, dt, props):
+        T_c, k, rhoC, Cp=props
+        dt_max=self.getdt(k, rhoC, self.Domain.hx)
+        order=self.RK.rk_embedded_order+1.0
+        count=0
+        while True:
+            self.Runge_Kutta(y, dt, props)
+            err=self.error_norm(y, self.ws.y_new, dt)
+            
+            # Error and stability limit from all processes in one reduction
+            buf=np.array([err, -dt_max])
+            self.mpi.max_all(buf)
+            err,dt_max=buf[0],-buf[1]
+            
+            if err<=1.0:
+                break
+            
+            # Reject step; restore state and recalculate properties
+            count+=1
+            if count>=self.countmax:
+                return dt, 1
+            self.set_state(y)
+            props=self.Domain.calcProp(self.Domain.T_guess)
+            dt*=max(self.facmin, self.safety*err**(-1/order))
+        
+        # PI step size controller for next step
+        err=max(err, 10**(-10))
+        fac=self.safety*err**(-0.7/order)*self.err_prev**(0.4/order)
+        if count>0:
+            fac=min(fac, 1.0)
+        self.dt_next=min(dt*min(self.facmax, max(self.facmin, fac)), dt_max)
+        self.err_prev=err
+        
+        return dt, 0
+    
+    # Reaction (source terms) over dt with no transport; advances y in place
+    # Kim source integrated in substeps at each node (stiff near reaction front)
+    def React(self, y, dt, rhoC):
+        if self.source_unif!='None':
+            y[0]+=self.source_unif*dt
+        if self.source_Kim=='True' or self.Domain.model=='Species':
+            E_kim, deta=self.get_source.Source_Comb_substeps(self.Domain.rho_0, \
+                                y[0]/rhoC, rhoC, y[1], dt, ind=self.Domain.active)
+            y[0]+=E_kim
+            y[1]+=deta
+            if self.Domain.model=='Species':
+                dm0,dm1=self.get_source.Source_mass(deta, self.Domain.porosity, self.Domain.rho_0)
+                y[2]+=dm0
+                y[3]-=dm1
+    
+    # Strang splitting; reaction half steps either side of transport step
+    # Reaction on y in place; new state put in workspace (y_new) and pointed to by domain
+    def Strang_split(self, y, dt, props):
+        T_c, k, rhoC, Cp=props
+        self.React(y, 0.5*dt, rhoC)
+        
+        # Transport (properties after reaction)
+        props=self.Domain.calcProp(self.Domain.T_guess)
+        self.Runge_Kutta(y, dt, props)
+        
+        # Reaction
+        T_c, k, rhoC, Cp=self.Domain.calcProp(self.Domain.T_guess)
+        self.React(self.ws.y_new, 0.5*dt, rhoC)
+    
+    # Moving window; reaction front (largest change in eta between nodes) kept
+    # at its location in window; returns number of nodes window moved
+    def Move_window(self):
+        d=self.Domain
+        n=np.argmax(np.abs(np.diff(d.eta)))-d.window[0]
+        if n<d.window[1]:
+            return 0
+        d.shift_window(n)
+        return n
+    
+    # Adaptive mesh refinement; regrid domain and rebuild what depends on mesh
+    # Returns True if mesh changed
+    def Regrid(self):
+        if not self.Domain.regrid():
+            return False
+        self.Remesh()
+        return True
+    
+    # State kept between time steps (checkpoint); BCs of each member (changed
+    # at ignition)
+    def checkpoint_state(self):
+        state={}
+        for name in self.state_names:
+            state[name]=getattr(self, name)
+        state['BCs']=[BC.BCs for BC in getattr(self.BCs, 'members', [self.BCs])]
+        return state
+    
+    # Restore state from checkpoint (domain restored first)
+    def restore_state(self, state):
+        for name in self.state_names:
+            setattr(self, name, state[name])
+        for BC,dic in zip(getattr(self.BCs, 'members', [self.BCs]), state['BCs']):
+            BC.BCs=dic
+        self.Remesh()
+    
+    # Rebuild what depends on local nodes of domain (BC node spacing, time step
+    # buffers, compiled kernel buffers); after regrid or load balancing
+    def Remesh(self):
+        self.dx=self.Domain.dx
+        for BC in getattr(self.BCs, 'members', [self.BCs]):
+            BC.dx=self.dx
+        self.ws=None
+        self.jit=None
+    
+    # Option code and values of a property for compiled kernels
+    # Returns None if the property option is not in jit_kernels.py
+    def jit_prop(self, opt, typ):
+        if type(opt) is not list:
+            return jit_kernels.CONST, float(opt), 0.0
+        elif opt[0]=='eta':
+            return jit_kernels.ETA, float(opt[1]), float(opt[2])
+        elif opt[0]=='Air' and opt[1]=='Temp' and typ!='k':
+            code=jit_kernels.AIR_CP
+            if typ=='Cv':
+                code=jit_kernels.AIR_CV
+            # Constant temperature value
+            if len(opt)>2:
+                return code+1, float(opt[2]), 0.0
+            return code, 0.0, 0.0
+        else:
+            return None
+    
+    # Pack settings into arrays for compiled kernels (jit_kernels.py)
+    # Returns reason if compiled backend cannot be used
+    def jit_setup(self):
+        if not jit_kernels.numba_avail:
+            return 'Numba not found'
+        if self.time_scheme!='Explicit':
+            return 'only for Explicit time scheme'
+        if self.Domain.members>1:
+            return 'not for ensemble runs'
+        d=self.Domain
+        jk=jit_kernels
+        opt=np.zeros(jk.N_OPT, dtype=int)
+        prm=np.zeros(jk.N_PRM)
+        
+        # Material properties
+        props=[(jk.CV_S, jk.V_CV_S, d.Cv, 'Cv'), (jk.K_S, jk.V_K_S, d.k, 'k')]
+        if d.model=='Species':
+            props+=[(jk.CV_G, jk.V_CV_G, d.Cv_g, 'Cv'), (jk.CP_G, jk.V_CP_G, d.Cp_g, 'Cp'),\
+                    (jk.K_G, jk.V_K_G, d.k_g, 'k')]
+        for i,j,val,typ in props:
+            code=self.jit_prop(val, typ)
+            if code is None:
+                return 'property option '+str(val)
+            opt[i],prm[j],prm[j+1]=code
+        if d.model=='Species':
+            opt[jk.MODEL]=1
+            modes=['Parallel','Geometric','Series']
+            if d.k_mode not in modes:
+                return 'k_model '+str(d.k_mode)
+            opt[jk.K_MODE]=modes.index(d.k_mode)
+            prm[jk.POR_0]=d.porosity_0
+            prm[jk.DIAM_2]=d.part_diam**2
+            prm[jk.KOZENY]=d.kozeny
+            prm[jk.MU]=d.mu
+            prm[jk.R_GAS]=d.R
+        else:
+            prm[jk.RHO]=d.rho*(1-d.porosity_0)
+        opt[jk.DIFF_INTER]=int(self.diff_inter!='Linear')
+        opt[jk.CONV_INTER]=int(self.conv_inter!='Linear')
+        
+        # Sources
+        if self.source_unif!='None':
+            opt[jk.UNIF]=1
+            prm[jk.SOURCE]=self.source_unif
+        opt[jk.KIM]=int(self.source_Kim=='True')
+        opt[jk.DH_VOL]=int(st.find(self.get_source.dH[0], 'vol')>=0)
+        prm[jk.A0]=self.get_source.A0
+        prm[jk.EA_R]=-self.get_source.Ea/self.get_source.R
+        prm[jk.DH]=self.get_source.dH[1]
+        prm[jk.GAS_GEN]=self.get_source.gas_gen
+        opt[jk.IGN_CHECK]=int(self.source_Kim=='True')
+        opt[jk.IGN_VAR]=int(self.ign[0]=='Temp')
+        prm[jk.IGN]=self.ign[1]
+        
+        # Ghost nodes (not in time step, ignition or divergence checks)
+        own=d.owned()
+        opt[jk.OWN_L]=own.start
+        opt[jk.OWN_R]=len(d.E)-own.stop
+        
+        # Time step
+        prm[jk.FO]=min(self.Fo, self.Domain.Fo_max)
+        prm[jk.DT]=-1.0
+        if self.dt!='None':
+            prm[jk.DT]=self.dt
+        
+        # Buffers; props=(T, k, rhoC, Cp, porosity, perm, P, T_guess)
+        n=len(d.E)
+        dum=np.zeros(n)
+        self.jit={'opt': opt, 'prm': prm, 'dum': dum,\
+                  'y_new': [np.zeros(n) for i in range(4)],\
+                  'props': tuple([np.zeros(n) for i in range(8)]),\
+                  'faces': (np.zeros(n-1), np.zeros(n-1)),\
+                  'geom': (d.hx, d.inv_hx, d.inv_dx, d.rho_0)}
+        self.jit['props'][-1][:]=d.T_guess
+        return None
+    
+    # Energy and pressure BCs for compiled kernels (BCs change at ignition)
+    def jit_BCs(self):
+        jk=jit_kernels
+        opt,prm=self.jit['opt'],self.jit['prm']
+        for side,o_E,o_rad,o_P,v_E,v_rad,v_P in \
+            [('left', jk.BC_L, jk.RAD_L, jk.P_L, jk.V_BC_L, jk.V_RAD_L, jk.V_P_L),\
+             ('right', jk.BC_R, jk.RAD_R, jk.P_R, jk.V_BC_R, jk.V_RAD_R, jk.V_P_R)]:
+            BC=self.BCs.BCs['bc_'+side+'_E']
+            if BC[0]=='F':
+                opt[o_E],prm[v_E]=0,BC[1]
+            elif BC[0]=='T':
+                opt[o_E],prm[v_E]=2,BC[1]
+            else:
+                opt[o_E],prm[v_E],prm[v_E+1]=1,BC[1][0],BC[1][1]
+            BC=self.BCs.BCs['bc_'+side+'_rad']
+            opt[o_rad]=0
+            if BC!='None':
+                opt[o_rad],prm[v_rad],prm[v_rad+1]=1,BC[0],BC[1]**4
+            BC=self.BCs.BCs['bc_'+side+'_P']
+            opt[o_P]=2
+            if BC[0]=='grad':
+                opt[o_P]=0
+            elif BC[0]=='P':
+                opt[o_P]=1
+            prm[v_P]=BC[1]
+    
+    # Explicit time steps with compiled kernels (jit_kernels.py)
+    # Up to nsteps on one process, stopping once time reaches t_stop
+    def Advance_jit(self, nt, t, ign, nsteps, t_stop):
+        d=self.Domain
+        jt=self.jit
+        opt,prm=jt['opt'],jt['prm']
+        self.jit_BCs()
+        y=self.get_state()
+        y_new=jt['y_new']
+        if d.model!='Species':
+            y+=[jt['dum'], jt['dum']]
+        y=tuple(y)
+        y_new=tuple(y_new)
+        props=jt['props']
+        if d.T_guess is not props[-1]:
+            props[-1][:]=d.T_guess
+        
+        if self.size==1:
+            self.nt_taken,dt_tot,dt,err,ign=jit_kernels.advance(nsteps, \
+                t_stop-t, ign, y, y_new, props, jt['geom'], jt['faces'], self.dx, opt, prm)
+        else:
+            dt=jit_kernels.calc_props(y, props, jt['geom'], opt, prm)
+            if self.dt!='None':
+                dt=min(self.dt, dt)
+            dt=self.agree_dt(dt)
+            if (np.isnan(dt)) or (dt<=0):
+                return 1, dt, ign
+            err,ign=jit_kernels.euler_step(dt, ign, y, y_new, props, jt['geom'], jt['faces'], self.dx, opt, prm)
+            for j in range(len(y)):
+                y[j][:]=y_new[j]
+            props[-1][:]=props[0]
+            self.nt_taken,dt_tot=1,dt
+        
+        # Properties of last step to domain
+        d.T_guess=props[-1]
+        d.porosity,d.perm,d.P=props[4],props[5],props[6]
+        if d.rank==0:
+            print 'Time step %i, Step size=%.7f, Time elapsed=%f;'%(nt+self.nt_taken,dt, t+dt_tot)
+        return err, dt_tot, ign
+    
+    # Time step used on all processes from time step of this process; smallest
+    # of all processes, or if lagged, smallest of all processes last time step
+    # (this process's value reduced with error code and ignition in main.py)
+    def agree_dt(self, dt):
+        if self.lag:
+            self.dt_local=dt
+            if self.dt_lag is not None:
+                return self.dt_lag
+        return self.mpi.min_dt(dt)
+    
     # Main solver (1 time step)
-    def Advance_Soln_Cond(self, nt, t, hx, ign):
-#    def Advance_Soln_Cond(self, nt, t, hx):
+    # Compiled backend may take up to nsteps, stopping once time reaches t_stop
+    def Advance_Soln_Cond(self, nt, t, ign, nsteps=1, t_stop=np.inf):
+        if self.backend=='Numba':
+            if self.jit is None:
+                msg=self.jit_setup()
+                if msg is not None:
+                    self.backend='NumPy'
+                    if self.Domain.rank==0:
+                        print 'Numba backend not used (%s); using NumPy routines'%(msg)
+            if self.backend=='Numba':
+                return self.Advance_jit(nt, t, ign, nsteps, t_stop)
+        self.nt_taken=1
         max_Y,min_Y=0,1
+        # Nodes near flame; reaction and porosity updates only done there
+        self.Domain.update_active()
         # Calculate properties
-        T_0, k, rhoC, Cp=self.Domain.calcProp(self.Domain.T_guess)
-        if self.dt=='None':
-            dt=self.getdt(k, rhoC, hx)
-            # Collect all dt from other processes and send minimum
-            dt=self.comm.reduce(dt, op=MPI.MIN, root=0)
-            dt=self.comm.bcast(dt, root=0)
+        props=self.Domain.calcProp(self.Domain.T_guess)
+        T_0, k, rhoC, Cp=props
+        if self.RK.adaptive and self.dt_next is not None:
+            # Time step from controller (agreed on all processes)
+            dt=self.dt_next
+        elif self.dt=='None':
+            dt=self.agree_dt(self.getdt(k, rhoC, self.Domain.hx))
         else:
-            dt=min(self.dt,self.getdt(k, rhoC, hx))
-            # Collect all dt from other processes and send minimum
-            dt=self.comm.reduce(dt, op=MPI.MIN, root=0)
-            dt=self.comm.bcast(dt, root=0)
+            dt=self.agree_dt(min(self.dt,self.getdt(k, rhoC, self.Domain.hx)))
         
         if (np.isnan(dt)) or (dt<=0):
             return 1, dt, ign
-        if self.Domain.rank==0:
+        if self.Domain.rank==0 and not self.RK.adaptive:
             print 'Time step %i, Step size=%.7f, Time elapsed=%f;'%(nt+1,dt, t+dt)
         
-        # If strang splitting
+        # State at beginning of time step
+        y=self.get_state()
+        if self.ws is None:
+            self.create_buffers(y)
+        
         if self.time_scheme=='Strang_split':
-            dt_strang=[0.5*dt, dt]
+            self.Strang_split(y, dt, props)
+            self.ws.y_new=y
+        elif self.RK.adaptive:
+            dt,err=self.Runge_Kutta_adaptive(y, dt, props)
+            if err>0:
+                return 1, dt, ign
+            # Previous state arrays become buffer for next step
+            self.ws.y_new=y
+            if self.Domain.rank==0:
+                print 'Time step %i, Step size=%.7f, Time elapsed=%f;'%(nt+1,dt, t+dt)
         else:
-            dt_strang=[dt]
+            self.Runge_Kutta(y, dt, props)
+            self.ws.y_new=y
         
-        # Copy needed variables and set pointers to other variables
-        E_0=self.Domain.E.copy()
-        T_c=T_0.copy()
-        if self.Domain.model=='Species':
-            rho_0=copy.deepcopy(self.Domain.rho_species)
-            rho_spec=copy.deepcopy(self.Domain.rho_species)
-            species=self.Domain.species_keys
-            mu=self.Domain.mu
-            perm=self.Domain.perm
-        
-        # Beginning of strang splitting routine (2 step process)
-        for i in range(len(dt_strang)):
-            ###################################################################
-            # Calculate source terms
-            ###################################################################
-            # Source terms
-            E_unif,E_kim=0,0
-            if i==0:
-                if self.source_unif!='None':
-                    E_unif      = self.source_unif
-                if self.source_Kim=='True' or self.Domain.model=='Species':
-                    E_kim, deta =self.get_source.Source_Comb_Kim(self.Domain.rho_0, T_c, self.Domain.eta, dt_strang[i])
-            
-            ###################################################################
-            # Conservation of Mass
-            ###################################################################
-            if self.Domain.model=='Species':
-                
-                # Calculate pressure
-                self.Domain.P=rho_spec[species[0]]/self.Domain.porosity*self.Domain.R*T_c
-                
-                # Use Darcy's law to directly calculate the velocities at the faces
-                flx=np.zeros_like(self.Domain.P)
-                
-                # Left face
-                flx[1:]+=dt_strang[i]/hx[1:]\
-                    *self.interpolate(rho_spec[species[0]][1:],rho_spec[species[0]][:-1],self.conv_inter)\
-                    *(-self.interpolate(perm[1:], perm[:-1],self.diff_inter)/mu\
-                    *(self.Domain.P[1:]-self.Domain.P[:-1])/self.dx[:-1])
-                    
-                # Right face
-                flx[:-1]-=dt_strang[i]/hx[:-1]\
-                    *self.interpolate(rho_spec[species[0]][1:],rho_spec[species[0]][:-1], self.conv_inter)\
-                    *(-self.interpolate(perm[1:], perm[:-1], self.diff_inter)/mu\
-                    *(self.Domain.P[1:]-self.Domain.P[:-1])/self.dx[:-1])
-                    
-                self.Domain.rho_species[species[0]]=rho_0[species[0]]+flx
-                self.Domain.rho_species[species[1]]=rho_0[species[1]].copy()
-                
-                # Source terms
-                dm0,dm1=self.get_source.Source_mass(deta, self.Domain.porosity, self.Domain.rho_0)
-                self.Domain.rho_species[species[0]]+=dm0*dt_strang[i]
-                self.Domain.rho_species[species[1]]-=dm1*dt_strang[i]
-                
-                # Apply pressure BCs
-                self.Domain.P=rho_spec[species[0]]/self.Domain.porosity*self.Domain.R*T_c
-                eflx=self.BCs.P(self.Domain.P, self.Domain.R, T_c)
-                self.Domain.rho_species[species[0]]+=eflx*self.Domain.porosity
-                
-                # Check max and min for divergence
-                max_Y=max(np.amax(self.Domain.rho_species[species[0]]),\
-                          np.amax(self.Domain.rho_species[species[1]]))
-                min_Y=min(np.amin(self.Domain.rho_species[species[0]]),\
-                          np.amin(self.Domain.rho_species[species[1]]))
-                
-                # Apply BCs
-#                self.BCs.mass(self.Domain.m_species[species[0]], self.Domain.P, Ax, Ay)
-            ###################################################################
-            # Conservation of Energy
-            ###################################################################
-            self.Domain.E=E_0.copy()
-            # Heat diffusion
-                #left faces
-            self.Domain.E[1:]   -= dt_strang[i]/hx[1:]\
-                        *self.interpolate(k[:-1],k[1:], self.diff_inter)\
-                        *(T_c[1:]-T_c[:-1])/self.dx[:-1]
-            
-                # Right face
-            self.Domain.E[:-1] += dt_strang[i]/hx[:-1]\
-                        *self.interpolate(k[1:],k[:-1], self.diff_inter)\
-                        *(T_c[1:]-T_c[:-1])/self.dx[:-1]
-            
-            # Source terms
-            self.Domain.E +=E_unif*dt_strang[i]
-            self.Domain.E +=E_kim *dt_strang[i]
-            
-            if self.Domain.model=='Species':
-                # Porous medium advection
-                eflx*=Cp*T_c # Convert mass flux to energy flux
-                    # Incoming fluxes (Darcy and diffusion)
-                eflx[1:]+=dt_strang[i]/hx[1:]\
-                    *self.interpolate(rho_spec[species[0]][1:],rho_spec[species[0]][:-1],self.conv_inter)*\
-                    (-self.interpolate(perm[1:], perm[:-1],self.diff_inter)/mu\
-                    *(self.Domain.P[1:]-self.Domain.P[:-1])/self.dx[:-1])\
-                    *self.interpolate(Cp[1:],Cp[:-1],self.conv_inter)\
-                    *self.interpolate(T_c[1:],T_c[:-1],self.conv_inter)
-                    
-                    # Outgoing fluxes (Darcy and diffusion)
-                eflx[:-1]-=dt_strang[i]/hx[:-1]\
-                    *self.interpolate(rho_spec[species[0]][1:],rho_spec[species[0]][:-1],self.conv_inter)*\
-                    (-self.interpolate(perm[1:], perm[:-1], self.diff_inter)/mu\
-                    *(self.Domain.P[1:]-self.Domain.P[:-1])/self.dx[:-1])\
-                    *self.interpolate(Cp[1:],Cp[:-1],self.conv_inter)\
-                    *self.interpolate(T_c[1:],T_c[:-1],self.conv_inter)
-                
-                self.Domain.E +=eflx
-            
-            # Apply boundary conditions
-            self.BCs.Energy(self.Domain.E, T_0, dt_strang[i], rhoC, hx)
+        # Checks on nodes owned by this process (ghost nodes may not have been
+        # updated correctly since last exchange)
+        d=self.Domain
+        own=d.owned()
+        if d.model=='Species':
+            species=d.species_keys
+            # Check max and min for divergence
+            max_Y=max(np.amax(d.rho_species[species[0]][...,own]),\
+                      np.amax(d.rho_species[species[1]][...,own]))
+            min_Y=min(np.amin(d.rho_species[species[0]][...,own]),\
+                      np.amin(d.rho_species[species[1]][...,own]))
         
-        # Check for ignition
-        if ign==0 and self.source_Kim=='True':
-            if ((self.ign[0]=='eta' and np.amax(self.Domain.eta)>=self.ign[1])\
-                or (self.ign[0]=='Temp' and np.amax(T_c)>=self.ign[1])):
-                ign=1
+        # Check for ignition (each ensemble member)
+        if self.source_Kim=='True':
+            if self.ign[0]=='eta':
+                ign_now=np.amax(d.eta[...,own], axis=-1)>=self.ign[1]
+            else:
+                ign_now=np.amax(T_0[...,own], axis=-1)>=self.ign[1]
+            ign=np.maximum(ign, ign_now.astype(int))
         
         # Save previous temp as initial guess for next time step
-        self.Domain.T_guess=T_0.copy()
+        d.T_guess=T_0
         ###################################################################
         # Divergence/Convergence checks
         ###################################################################
-        if (np.isnan(np.amax(self.Domain.E))) \
-        or (np.amin(self.Domain.E)<=0):
+        if (np.isnan(np.amax(d.E[...,own]))) \
+        or (np.amin(d.E[...,own])<=0):
             return 2, dt, ign
-        elif (np.amax(self.Domain.eta)>1.0) or (np.amin(self.Domain.eta)<-10**(-9)):
+        elif (np.amax(d.eta[...,own])>1.0) or (np.amin(d.eta[...,own])<-10**(-9)):
             return 3, dt, ign
-        elif self.Domain.model=='Species' and ((min_Y<-10)\
+        elif d.model=='Species' and ((min_Y<-10)\
                   or np.isnan(max_Y)):
             return 4, dt, ign
         else:
@@ -13,6 +13,13 @@ This file contains the Combustion source term classes:
 Features of Source_Kim:
     -Activation energy, pre-exponential factor, enthalpy of combustion
     -Enthalpy of combustion can be density or volume based (input file)
+    -Reaction step over a time step (splitting); exact integration of Kim
+    source at constant temperature, in substeps at each node so temperature
+    rises with heat released
+    -Optional lookup table of Arrhenius factors exp(-Ea/R/T), linear in 1/T
+    with spacing set by relative error allowed; rate zero (not evaluated) below
+    cutoff temperature or where reaction is complete
+    -Rates can be limited to given nodes (active region of domain)
 
 Notes on implementing Cantera:
     -sol=ct.Solution('___.cti') -> define solution mechanisms?
@@ -25,8 +32,12 @@ import numpy as np
 import string as st
 #import cantera as ct
 
+# Umbrajkar temperature ranges; A, n, Ea
+Umbrajkar=[(10**(6.68), 0.6, 78000), (10**(5.15), 3.9, 79000),\
+           (10**(5.03), 2.6, 102000), (10**(13.3), 0.75, 266000)]
+
 class Source_terms():
-    def __init__(self, Ea, A0, dH, gs_gen):
+    def __init__(self, Ea, A0, dH, gs_gen, table='None'):
         self.R=8.314 # J/mol/K
         self.Ea=Ea # J/mol
         self.A0=A0
@@ -34,49 +45,207 @@ class Source_terms():
         self.dH[1]=float(self.dH[1])
         self.n=0.2 # Temperature exponent
         self.gas_gen=gs_gen
+        # Reaction substeps (Source_Comb_substeps)
+        self.deta_sub=0.05 # Max change in eta in a substep
+        self.dk_sub=0.2 # Max relative change of rate (temperature rise) in a substep
+        self.max_sub=1000 # Max substeps; last one takes rest of time step
+        # Arrhenius factor table ('None' or [relative error],[cutoff temperature])
+        self.tab=None
+        if st.find(table, 'None')<0:
+            table=st.split(table, ',')
+            self.Rate_table(float(table[0]), float(table[1]))
         
+    # Build table of exp(-Ea/R/T) for Kim (row for each ensemble member) then
+    # Umbrajkar activation energies on uniform grid of x=1/T
+    # Linear interpolation of exp(-a*x) has relative error below (a*h)^2/8
+    # Entries past 1/T_cut are 0; no reaction below cutoff (within one interval)
+    def Rate_table(self, tol, T_cut):
+        self.T_cut=T_cut
+        Ea=np.append(np.ravel(self.Ea), [i[2] for i in Umbrajkar])
+        h=np.sqrt(8*tol)/(np.amax(Ea)/self.R)
+        n_cut=int(1.0/T_cut/h)+1
+        self.tab_n=n_cut+2
+        self.inv_h=1/h
+        tab=np.exp(-np.outer(Ea/self.R, np.arange(self.tab_n)*h))
+        tab[:,n_cut+1:]=0
+        # Values and slopes (per interval); index clipped to last (zero) entry
+        self.dtab=np.ravel(np.diff(tab, axis=1, append=0))
+        self.tab=np.ravel(tab)
+        self.tab_Umb=np.size(self.Ea) # First Umbrajkar row
+    
+    # Interpolated Arrhenius factors of table rows at T; list of factors if
+    # rows is a list (interval found once)
+    def Arrhenius(self, rows, T):
+        w=self.inv_h/T
+        np.minimum(w, self.tab_n-1, out=w)
+        i=w.astype(int)
+        w-=i
+        if type(rows) is list:
+            return [self.Interpolate(i+r*self.tab_n, w) for r in rows]
+        if np.size(rows)>1 or rows>0:
+            i+=rows*self.tab_n
+        return self.Interpolate(i, w)
+    
+    # Table value at index i plus fraction w of interval (in place to limit temporaries)
+    def Interpolate(self, i, w):
+        f=self.tab[i]
+        d=self.dtab[i]
+        d*=w
+        f+=d
+        return f
+    
+    # Flat index of nodes where reaction proceeds (above cutoff, eta<1);
+    # None if more than a quarter of nodes (cheaper to use table at all nodes)
+    def Active(self, T, eta):
+        active=(T>=self.T_cut)&(eta<1)
+        if np.count_nonzero(active)*4>np.size(active):
+            return None
+        return np.flatnonzero(active)
+    
+    # Value of (ensemble) parameter at flat index ind of array of given shape
+    def Node_values(self, val, shape, ind):
+        if np.size(val)==1:
+            return val
+        return np.broadcast_to(val, shape).flat[ind]
+    
     # Calculate source term for combustion based on
     # K. Kim, "Computational Modeling of Combustion Wave in Nanoscale Thermite Reaction",
     # Int. J of Energy and Power engineering, vol.8, no.7, pp. 612-615, 2014.
     def Source_Comb_Kim(self, rho, T, eta, dt):
-        detadt=self.A0*(1-eta)*np.exp(-self.Ea/self.R/T)
+        E_kim, detadt=self.Source_Comb_Kim_rate(rho, T, eta)
         eta+=dt*detadt
         
         # Clipping to 0
 #        eta[eta<10**(-10)]=0
+        return E_kim, detadt
+    
+    # Rate of reaction and heat generation from Kim source (eta not updated)
+    # Rate only at nodes with flat index ind if given (zero at other nodes)
+    def Source_Comb_Kim_rate(self, rho, T, eta, ind=None):
+        shape=np.shape(eta)
+        if ind is None and self.tab is not None:
+            ind=self.Active(T, eta)
+        if ind is None:
+            if self.tab is None:
+                detadt=self.A0*(1-eta)*np.exp(-self.Ea/self.R/T)
+            else:
+                rows=0
+                if np.size(self.Ea)>1:
+                    rows=np.arange(shape[0]).reshape(-1,1)
+                detadt=self.A0*(1-eta)*self.Arrhenius(rows, T)
+        else:
+            T=T.flat[ind]
+            if self.tab is None:
+                f=np.exp(-self.Node_values(self.Ea, shape, ind)/self.R/T)
+            else:
+                rows=0
+                if np.size(self.Ea)>1:
+                    rows=ind//shape[-1]
+                f=self.Arrhenius(rows, T)
+            detadt=np.zeros(shape)
+            detadt.flat[ind]=self.Node_values(self.A0, shape, ind)*(1-eta.flat[ind])*f
+        
         if st.find(self.dH[0], 'vol')>=0:
             return self.dH[1]*detadt, detadt
         else:
             return rho*self.dH[1]*detadt, detadt
     
+    # Reaction over dt at each node (operator splitting); returns energy released
+    # and change in eta (not rates)
+    # Nodes take own substeps (limited by change in eta and in rate from temperature
+    # rise) with temperature raised by heat released at constant rhoC
+    # Kim source exact at constant (mid-substep) temperature in a substep; 1-eta
+    # decays exponentially so eta cannot pass 1
+    # Only nodes with flat index ind react if given
+    def Source_Comb_substeps(self, rho, T, rhoC, eta, dt, ind=None):
+        shape=np.shape(eta)
+        # Per-node values (ensemble parameters are columns)
+        if st.find(self.dH[0], 'vol')>=0:
+            q=np.ravel(self.dH[1]*np.ones(shape))
+        else:
+            q=np.ravel(rho*self.dH[1]*np.ones(shape))
+        A0=np.ravel(self.A0*np.ones(shape))
+        Ea=np.ravel(self.Ea*np.ones(shape))
+        T=np.ravel(T).copy()
+        rhoC=np.ravel(rhoC*np.ones(shape))
+        eta_0=np.ravel(eta)
+        eta=eta_0.copy()
+        t_left=np.ones_like(eta)*dt
+        
+        # Nodes with time left in step
+        if ind is None:
+            ind=np.arange(len(eta))
+        if self.tab is not None:
+            ind=ind[(T[ind]>=self.T_cut)&(eta[ind]<1)]
+            # Table rows of Kim factor at each node
+            rows=np.zeros(len(eta), dtype=int)
+            if np.size(self.Ea)>1:
+                rows=np.arange(len(eta))//shape[-1]
+        for i in range(self.max_sub):
+            if len(ind)==0:
+                break
+            if self.tab is None:
+                k=A0[ind]*np.exp(-Ea[ind]/self.R/T[ind])
+            else:
+                k=A0[ind]*self.Arrhenius(rows[ind], T[ind])
+            detadt=k*(1-eta[ind])
+            # Rate of temperature rise and relative change in rate
+            dTdt=q[ind]*np.abs(detadt)/rhoC[ind]
+            dkdt=Ea[ind]/self.R/T[ind]**2*dTdt
+            h=t_left[ind]
+            if i<self.max_sub-1:
+                h=np.minimum(h, self.deta_sub/(np.abs(detadt)+10**(-30)))
+                h=np.minimum(h, self.dk_sub/(dkdt+10**(-30)))
+            deta=-np.expm1(-k*h)*(1-eta[ind])
+            # Rate at mid-substep temperature
+            if self.tab is None:
+                k=A0[ind]*np.exp(-Ea[ind]/self.R/(T[ind]+0.5*q[ind]*deta/rhoC[ind]))
+            else:
+                k=A0[ind]*self.Arrhenius(rows[ind], T[ind]+0.5*q[ind]*deta/rhoC[ind])
+            deta=-np.expm1(-k*h)*(1-eta[ind])
+            eta[ind]+=deta
+            T[ind]+=q[ind]*deta/rhoC[ind]
+            t_left[ind]-=h
+            ind=ind[t_left[ind]>0]
+        
+        deta=(eta-eta_0).reshape(shape)
+        return (q*np.ravel(deta)).reshape(shape), deta
+    
+    # Rate of reaction from Umbrajkar source (eta not updated)
+    # First and fourth ranges use log((1-eta)**(1-1/n))=(1-1/n)*log(1-eta)
+    def Source_Comb_Umbrajkar_rate(self, T, eta):
+        if self.tab is None:
+            f=[np.exp(-i[2]/8.314/T) for i in Umbrajkar]
+        else:
+            shape=np.shape(eta)
+            ind=self.Active(T, eta)
+            if ind is not None:
+                T=T.flat[ind]
+                eta=eta.flat[ind]
+            f=self.Arrhenius(range(self.tab_Umb, self.tab_Umb+len(Umbrajkar)), T)
+        log_eta=np.log(1-eta)
+        
+        deta=0
+        for i in range(len(Umbrajkar)):
+            A,n,Ea=Umbrajkar[i]
+            if i==0 or i==3:
+                deta+=A*n*(eta-1)*(1-1/n)*log_eta*f[i]
+            else:
+                deta+=A*(1-eta)**n*f[i]
+        
+#        deta4=self.A0*(1-eta)*np.exp(-self.Ea/self.R/T)
+        
+        if self.tab is None or ind is None:
+            return deta
+        detadt=np.zeros(shape)
+        detadt.flat[ind]=deta
+        return detadt
+    
     # Source term for combustion based on
     # Umbrajkar, S et al., "Exothermic reactions in Al-CuO nanocomposites",
     # Thermochimica Acta, vol.451, pp. 34-43, 2006.
     def Source_Comb_Umbrajkar(self, rho, T, eta, dt):
-        # First temp range
-        A=10**(6.68)
-        n=0.6
-        Ea=78000
-        deta1=A*n*(eta-1)*np.log((1-eta)**(1-1/n))*np.exp(-Ea/8.314/T)
-        # Second temp range
-        A=10**(5.15)
-        n=3.9
-        Ea=79000
-        deta2=A*(1-eta)**n*np.exp(-Ea/8.314/T)
-        # Third temp range
-        A=10**(5.03)
-        n=2.6
-        Ea=102000
-        deta3=A*(1-eta)**n*np.exp(-Ea/8.314/T)
-        # Fourth temp range
-        A=10**(13.3)
-        n=0.75
-        Ea=266000
-        deta4=A*n*(eta-1)*np.log((1-eta)**(1-1/n))*np.exp(-Ea/8.314/T)
-        
-#        deta4=self.A0*(1-eta)*np.exp(-self.Ea/self.R/T)
-        
-        detadt=deta1+deta2+deta3+deta4
+        detadt=self.Source_Comb_Umbrajkar_rate(T, eta)
         eta+=dt*detadt
         
         # Clipping to 0
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+Checks of Runge-Kutta tableaus in temporal_schemes.py
+
+Features:
+    -order conditions (up to 4th order) for every selectable scheme
+    -schemes without Butcher tableau rejected by runge_kutta
+
+Run with: python -m pytest Tests
+"""
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import temporal_schemes
+
+# Order of each scheme; every selectable scheme must be listed
+ORDER={'EULER':1, 'RK2':2, 'RK3':3, 'RK4':4, 'RK4_CLASSICAL':4,
+       'RK6':6, 'RK8':8, 'RK3_BS':3, 'RK5_DP':5}
+TOL=1e-7 # Some tableaus are given to 8 or 9 digits
+
+# Residuals of order conditions up to min(order,4)
+def order_residuals(A, b, order):
+    c=np.sum(A, axis=1)
+    res=[np.sum(b)-1.0]
+    if order>=2:
+        res.append(np.dot(b, c)-1./2)
+    if order>=3:
+        res.append(np.dot(b, c**2)-1./3)
+        res.append(np.dot(b, np.dot(A, c))-1./6)
+    if order>=4:
+        res.append(np.dot(b, c**3)-1./4)
+        res.append(np.dot(b*c, np.dot(A, c))-1./8)
+        res.append(np.dot(b, np.dot(A, c**2))-1./12)
+        res.append(np.dot(b, np.dot(A, np.dot(A, c)))-1./24)
+    return np.array(res)
+
+class TestSchemes(unittest.TestCase):
+    def test_order_conditions(self):
+        for key in temporal_schemes.runge_kutta('Euler').listSupportedSchemes():
+            data=temporal_schemes.scheme_data[key]
+            A=np.array(data['rk_coeff'], dtype='float64')
+            b=data['rk_substep_fraction']
+            self.assertIn(key, ORDER)
+            self.assertEqual(A.shape, (len(b), len(b)))
+            self.assertTrue(np.allclose(np.triu(A), 0), key+' is not explicit')
+            res=order_residuals(A, b, ORDER[key])
+            self.assertTrue(np.amax(np.abs(res))<TOL, key+': %s'%res)
+            if 'rk_embedded_fraction' in data:
+                res=order_residuals(A, data['rk_embedded_fraction'], data['rk_embedded_order'])
+                self.assertTrue(np.amax(np.abs(res))<TOL, key+' (embedded): %s'%res)
+
+    def test_low_storage_rejected(self):
+        RK=temporal_schemes.runge_kutta('RK4_LOW')
+        self.assertEqual(RK.Nk, -1)
+        self.assertNotIn('RK4_LOW', RK.listSupportedSchemes())
+
+if __name__=='__main__':
+    unittest.main()
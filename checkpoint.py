@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains the checkpoint routines (Checkpoint setting):
+    -full state of a run (domain, solver, front diagnostics, time loop
+    variables) saved by each process in its own binary file (pickle) every
+    given number of time steps and/or minutes
+    -last given number of checkpoints kept; number of latest complete
+    checkpoint in latest_file (written once all processes have written theirs)
+    -restart (Restart:Checkpoint) from latest checkpoint continues the time
+    loop with the same state; same number of processes
+
+Features/assumptions:
+    -files written to a temporary name and renamed, so a checkpoint being
+    written never replaces a complete one
+    -whether a checkpoint is due is found on each process and agreed with the
+    error code reduction every time step (see main.py)
+
+"""
+
+import os
+import string as st
+from mpi4py import MPI
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+latest_file='Checkpoint_latest.txt'
+
+# Checkpoint file of process
+def file_name(number, rank):
+    return 'Checkpoint_%i_%i.chk'%(number, rank)
+
+# Write to temporary file then rename (complete file or none)
+def write_file(path, data):
+    with open(path+'.tmp', 'wb') as f:
+        f.write(data)
+    os.rename(path+'.tmp', path)
+
+class Checkpointer():
+    # Setting is None or [time steps],[minutes],[checkpoints kept]; 0 time
+    # steps or minutes to not use that interval
+    def __init__(self, comm, setting):
+        self.comm=comm
+        self.rank=comm.Get_rank()
+        self.size=comm.Get_size()
+        self.steps,self.minutes,self.keep=0,0,1
+        if setting!='None':
+            steps,minutes,keep=st.split(setting, ',')
+            self.steps,self.minutes,self.keep=int(steps),float(minutes),int(keep)
+        self.number=0 # Number of last checkpoint
+        self.nt_next=self.steps # Time step of next checkpoint
+        self.wall=MPI.Wtime() # Wall clock time of last checkpoint
+
+    # Checkpoint due at this time step (this process)
+    def due(self, nt):
+        if self.steps>0 and nt>=self.nt_next:
+            return 1
+        if self.minutes>0 and MPI.Wtime()-self.wall>=self.minutes*60:
+            return 1
+        return 0
+
+    # Save state (dictionary) of this process at time step nt (all processes);
+    # oldest checkpoint removed once more than keep
+    def save(self, state, nt):
+        self.number+=1
+        write_file(file_name(self.number, self.rank), pickle.dumps(state, 2))
+        self.comm.Barrier()
+        if self.rank==0:
+            write_file(latest_file, ('%i %i\n'%(self.number, self.size)).encode())
+        self.comm.Barrier()
+        old=file_name(self.number-self.keep, self.rank)
+        if self.number>self.keep and os.path.isfile(old):
+            os.remove(old)
+        self.nt_next=nt+self.steps
+        self.wall=MPI.Wtime()
+
+# Number and state of this process of latest checkpoint; None if there is no
+# checkpoint or it was written by a different number of processes
+def load(comm):
+    if not os.path.isfile(latest_file):
+        return None, None
+    with open(latest_file, 'r') as f:
+        number,size=[int(i) for i in st.split(f.readline())]
+    if size!=comm.Get_size():
+        return None, None
+    with open(file_name(number, comm.Get_rank()), 'rb') as f:
+        state=pickle.load(f)
+    return number, state
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains the reaction front diagnostics class:
+    -front position (integral of eta over x), burnt mass per unit area
+    (integral of eta*rho_0) and peak temperature
+    -instantaneous wave speed between calls and wave speed fit (least squares)
+    to front positions over a sliding window of time steps
+
+Features/assumptions:
+    -sums over nodes of each process (ghost nodes not included; same nodes
+    as compile_vars), combined with one Allreduce per call (sums and maximum
+    packed in one array)
+    -peak temperature from latest temperature (T_guess)
+    -moving window; nodes left behind window counted as fully reacted
+    -ensemble runs; values for each member, fit only uses time steps after
+    that member ignited
+
+"""
+
+import numpy as np
+from collections import deque
+from mpi4py import MPI
+
+# Reduction of rows (position, burnt mass, peak temperature); sum of first
+# two columns and maximum of last
+def sum_max(inbuf, outbuf, datatype):
+    a=np.frombuffer(inbuf, dtype=float).reshape(-1,3)
+    b=np.frombuffer(outbuf, dtype=float).reshape(-1,3)
+    b[:,:2]+=a[:,:2]
+    np.maximum(b[:,2], a[:,2], out=b[:,2])
+
+class Front_tracker():
+    def __init__(self, comm, size, Domain, window):
+        self.comm=comm
+        self.size=size
+        self.window=window # Time steps used in wave speed fit
+        self.op=None
+        if size>1:
+            self.op=MPI.Op.Create(sum_max, commute=True)
+        self.X_0=Domain.X[0] # Left end of domain at start (moving window)
+        self.buf=np.zeros((Domain.members,3))
+        self.out=np.zeros((Domain.members,3))
+
+        # Latest values of each member
+        self.position=np.zeros(Domain.members)
+        self.mass=np.zeros(Domain.members)
+        self.T_max=np.zeros(Domain.members)
+        self.speed_inst=np.zeros(Domain.members)
+
+        # Times and front positions of last time steps
+        self.t=deque(maxlen=window)
+        self.x=deque(maxlen=window)
+        self.n=np.zeros(Domain.members, dtype=int) # Time steps since ignition
+
+    # State (checkpoint); all attributes except communication
+    def checkpoint_state(self):
+        state=dict(self.__dict__)
+        del state['comm'], state['op']
+        return state
+    
+    def restore_state(self, state):
+        self.__dict__.update(state)
+
+    # Sums over nodes of this process (rows for each member)
+    def local_sums(self, Domain):
+        d=Domain
+        own=d.owned()
+        eta=d.eta[...,own]
+        eta_hx=eta*d.hx[own]
+        buf=self.buf
+        buf[:,0]=np.sum(eta_hx, axis=-1)
+        buf[:,1]=np.sum(eta_hx*d.rho_0[...,own], axis=-1)
+        buf[:,2]=np.amax(d.T_guess[...,own], axis=-1)
+        # Nodes left behind moving window
+        if d.proc_left<0:
+            burnt=d.X[0]-self.X_0
+            buf[:,0]+=burnt
+            buf[:,1]+=d.rho_0[...,0]*burnt
+        return buf
+
+    # Diagnostics at time t (all processes); ign is ignition flag (of each member)
+    def update(self, Domain, t, ign):
+        buf=self.local_sums(Domain)
+        if self.size>1:
+            self.comm.Allreduce(buf, self.out, op=self.op)
+            buf=self.out
+        if len(self.t)>0 and t>self.t[-1]:
+            self.speed_inst=(buf[:,0]-self.x[-1])/(t-self.t[-1])
+        self.position=buf[:,0].copy()
+        self.mass=buf[:,1].copy()
+        self.T_max=buf[:,2].copy()
+        self.t.append(t)
+        self.x.append(self.position)
+        self.n+=np.asarray(ign).reshape(-1)==1
+
+    # Wave speed of each member; slope of line fit to front positions over
+    # last time steps (0 if fewer than 2 time steps since ignition)
+    def speed(self):
+        v=np.zeros(len(self.n))
+        t=np.array(self.t)
+        x=np.array(self.x)
+        for i in range(len(v)):
+            n=min(self.n[i], len(t))
+            if n<2:
+                continue
+            dt=t[-n:]-np.mean(t[-n:])
+            v[i]=np.sum(dt*x[-n:,i])/np.sum(dt**2)
+        return v
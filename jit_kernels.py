@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains compiled (Numba) kernels for the explicit solver:
+    -Properties (as in GeomClasses calcProp) and stable time step
+    -One forward Euler step of all terms (Kim source, Darcy fluxes, heat
+    diffusion, boundary conditions) in one pass over the nodes
+    -Several time steps per call (serial runs)
+    -Time step, ignition and divergence checks on nodes owned by process
+    (ghost nodes excluded)
+
+Features/assumptions:
+    -Numba is optional; if it cannot be imported, numba_avail is False and
+    the solver uses its NumPy routines
+    -Operations done in same order as the NumPy routines
+    -Option codes and values packed into arrays by solver (see jit_setup
+    in SolverClasses.py)
+
+"""
+
+import numpy as np
+try:
+    from numba import njit
+    numba_avail=True
+except ImportError:
+    numba_avail=False
+    # Kernels stay plain Python functions
+    def njit(*args, **kwargs):
+        if len(args)==1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Integer option indices
+MODEL, KIM, DH_VOL, DIFF_INTER, CONV_INTER, K_MODE=0,1,2,3,4,5
+CV_S, K_S, CV_G, CP_G, K_G=6,7,8,9,10
+BC_L, BC_R, RAD_L, RAD_R, P_L, P_R=11,12,13,14,15,16
+IGN_VAR, IGN_CHECK, UNIF=17,18,19
+OWN_L, OWN_R=20,21 # Ghost nodes at each end (not in checks)
+N_OPT=22
+
+# Float value indices (properties have 2 values each)
+FO, DT, SOURCE, A0, EA_R, DH, GAS_GEN=0,1,2,3,4,5,6
+POR_0, DIAM_2, KOZENY, MU, R_GAS, RHO, IGN=7,8,9,10,11,12,13
+V_CV_S, V_K_S, V_CV_G, V_CP_G, V_K_G=14,16,18,20,22
+V_BC_L, V_BC_R, V_RAD_L, V_RAD_R, V_P_L, V_P_R=24,26,28,30,32,34
+N_PRM=36
+
+# Property codes
+CONST, ETA, AIR_CP, AIR_CP_CONST, AIR_CV, AIR_CV_CONST=0,1,2,3,4,5
+
+# Gas constant of air (MatClasses)
+R_AIR=8.314*1000/28.97
+E_8=10**(-8)
+
+# Specific heat of air; same as MatClasses.Cp.Air
+@njit(cache=True)
+def Air_Cp(T):
+    Cp=1.4070e-10*T
+    Cp+=-6.6196e-7
+    Cp*=T
+    Cp+=1.0584e-3
+    Cp*=T
+    Cp+=-4.664e-1
+    Cp*=T
+    Cp+=1.0718e3
+    return Cp
+
+# Property value at a node from option code
+@njit(cache=True)
+def prop(code, v1, v2, eta, T_guess):
+    if code==CONST:
+        return v1
+    elif code==ETA:
+        return eta*v2+(1-eta)*v1
+    elif code==AIR_CP:
+        return Air_Cp(T_guess)
+    elif code==AIR_CP_CONST:
+        return Air_Cp(v1)
+    elif code==AIR_CV:
+        return Air_Cp(T_guess)-R_AIR
+    else:
+        return Air_Cp(v1)-R_AIR
+
+# Interpolation to face (same as OneDimLineSolve.interpolate)
+@njit(cache=True)
+def interpolate(k1, k2, harmonic):
+    if harmonic:
+        return k1*2*k2/(k1+k2)
+    else:
+        return k1*0.5+k2*0.5
+
+# Properties of state; returns stable time step on these nodes
+# y=(E, eta, rho_g, rho_s); props=(T, k, rhoC, Cp, porosity, perm, P, T_guess)
+@njit(cache=True)
+def calc_props(y, props, geom, opt, prm):
+    E,eta,rho_g,rho_s=y
+    T,k,rhoC,Cp,por,perm,P,T_guess=props
+    hx,inv_hx,inv_dx,rho_0=geom
+    dt=np.inf
+    n=len(E)
+    for i in range(n):
+        Cv=prop(opt[CV_S], prm[V_CV_S], prm[V_CV_S+1], eta[i], T_guess[i])
+        k_s=prop(opt[K_S], prm[V_K_S], prm[V_K_S+1], eta[i], T_guess[i])
+        if opt[MODEL]==1:
+            # Changing porosity/permeability
+            por[i]=prm[POR_0]+(1-rho_s[i]/rho_0[i])*(1-prm[POR_0])
+            perm[i]=por[i]**3.0*prm[DIAM_2]\
+                /(prm[KOZENY]*((1-por[i])*(1-por[i])))
+            rhoC[i]=rho_s[i]*Cv
+            rhoC[i]+=rho_g[i]*prop(opt[CV_G], prm[V_CV_G], prm[V_CV_G+1], eta[i], T_guess[i])
+            T[i]=E[i]/rhoC[i]
+            Cp[i]=prop(opt[CP_G], prm[V_CP_G], prm[V_CP_G+1], eta[i], T_guess[i])
+            k_g=prop(opt[K_G], prm[V_K_G], prm[V_K_G+1], eta[i], T_guess[i])
+            if opt[K_MODE]==0:
+                k[i]=por[i]*k_g+(1-por[i])*k_s
+            elif opt[K_MODE]==1:
+                k[i]=k_s*(k_g/k_s)**por[i]
+            else:
+                k[i]=1/(por[i]/k_g+(1-por[i])/k_s)
+            # Darcy flow stability limit (as in getdt)
+            D=rho_g[i]/por[i]*prm[R_GAS]*T[i]
+            D*=perm[i]/prm[MU]/(hx[i]*hx[i])
+            if D>0 and i>=opt[OWN_L] and i<n-opt[OWN_R]:
+                dt=min(dt, 0.5/D)
+        else:
+            rhoC[i]=prm[RHO]*Cv
+            T[i]=E[i]/rhoC[i]
+            Cp[i]=0.0
+            k[i]=k_s
+        if i>=opt[OWN_L] and i<n-opt[OWN_R]:
+            dt=min(dt, prm[FO]*rhoC[i]/k[i]*(hx[i]*hx[i]))
+
+    return dt
+
+# Energy BC rate at boundary node (flux, convective, radiation)
+@njit(cache=True)
+def Energy_rate(dE, T, hx, typ, v1, v2, rad, eps, T_inf4):
+    if typ==0:
+        dE+=v1/hx
+    elif typ==1:
+        dE+=(-v1*T+v1*v2)/hx
+    if rad==1:
+        dE+=1/hx*eps*5.67*E_8*(T_inf4-T**4.0)
+    return dE
+
+# Pressure BC flux (not a rate); P_0 is pressure required at boundary
+@njit(cache=True)
+def P_flux(P_0, P, R, T):
+    return min((P_0-P)/(R*T),0.0)
+
+# Forward Euler step of properties given by calc_props; new state put in y_new
+# Returns error code (as in Advance_Soln_Cond) and ignition flag
+@njit(cache=True)
+def euler_step(dt, ign, y, y_new, props, geom, faces, dx, opt, prm):
+    E,eta,rho_g,rho_s=y
+    E_n,eta_n,rho_g_n,rho_s_n=y_new
+    T,k,rhoC,Cp,por,perm,P,T_guess=props
+    hx,inv_hx,inv_dx,rho_0=geom
+    mflux,eflux=faces
+    n=len(E)
+    species=opt[MODEL]==1
+
+    # Pressure
+    if species:
+        for i in range(n):
+            P[i]=rho_g[i]/por[i]*prm[R_GAS]*T[i]
+
+    # Face fluxes (positive in +x direction)
+    for f in range(n-1):
+        flx=0.0
+        if species:
+            # Darcy mass flux and enthalpy it carries
+            u=-interpolate(perm[f+1], perm[f], opt[DIFF_INTER])/prm[MU]\
+                *(P[f+1]-P[f])*inv_dx[f]
+            mflux[f]=interpolate(rho_g[f+1], rho_g[f], opt[CONV_INTER])*u
+            flx=interpolate(Cp[f+1], Cp[f], opt[CONV_INTER])*mflux[f]\
+                *interpolate(T[f+1], T[f], opt[CONV_INTER])
+        # Heat diffusion
+        flx+=interpolate(k[f+1], k[f], opt[DIFF_INTER])*(T[f+1]-T[f])*inv_dx[f]*-1.0
+        eflux[f]=flx
+
+    # Node rates and new state
+    for i in range(n):
+        dE=0.0
+        deta=0.0
+        if opt[UNIF]==1:
+            dE+=prm[SOURCE]
+        if opt[KIM]==1 or species:
+            rate=prm[A0]*(1-eta[i])*np.exp(prm[EA_R]/T[i])
+            if opt[DH_VOL]==1:
+                dE+=prm[DH]*rate
+            else:
+                dE+=rho_0[i]*prm[DH]*rate
+            deta+=rate
+        if i>0:
+            dE+=eflux[i-1]*inv_hx[i]
+        if i<n-1:
+            dE-=eflux[i]*inv_hx[i]
+        if i==0:
+            dE=Energy_rate(dE, T[i], hx[i], opt[BC_L], prm[V_BC_L], prm[V_BC_L+1],\
+                           opt[RAD_L], prm[V_RAD_L], prm[V_RAD_L+1])
+        if i==n-1:
+            dE=Energy_rate(dE, T[i], hx[i], opt[BC_R], prm[V_BC_R], prm[V_BC_R+1],\
+                           opt[RAD_R], prm[V_RAD_R], prm[V_RAD_R+1])
+        E_n[i]=E[i]+dE*dt
+        eta_n[i]=eta[i]+deta*dt
+
+        if species:
+            dm=deta*rho_0[i]*prm[GAS_GEN]
+            drho=0.0
+            drho+=dm
+            if i>0:
+                drho+=mflux[i-1]*inv_hx[i]
+            if i<n-1:
+                drho-=mflux[i]*inv_hx[i]
+            rho_g_n[i]=rho_g[i]+drho*dt
+            rho_s_n[i]=rho_s[i]+(0.0-dm)*dt
+
+    # Pressure BCs (mass removed from boundary nodes)
+    if species:
+        for i in [0, n-1]:
+            if i==0:
+                typ,val=opt[P_L],prm[V_P_L]
+                P_0=P[1]-val*dx[0]
+            else:
+                typ,val=opt[P_R],prm[V_P_R]
+                P_0=val*dx[-1]+P[-2]
+            if typ==1:
+                P_0=val
+            elif typ==2:
+                P_0=P[i]
+            flx=P_flux(P_0, P[i], prm[R_GAS], T[i])
+            rho_g_n[i]+=flx*por[i]
+            E_n[i]+=flx*Cp[i]*T[i]
+
+    # Fixed temperature BCs
+    if opt[BC_L]==2:
+        E_n[0]=prm[V_BC_L]*rhoC[0]
+    if opt[BC_R]==2:
+        E_n[-1]=prm[V_BC_R]*rhoC[-1]
+
+    # Ignition (nodes owned by this process)
+    i0,i1=opt[OWN_L],n-opt[OWN_R]
+    if ign==0 and opt[IGN_CHECK]==1:
+        if (opt[IGN_VAR]==0 and np.amax(eta_n[i0:i1])>=prm[IGN])\
+            or (opt[IGN_VAR]==1 and np.amax(T[i0:i1])>=prm[IGN]):
+            ign=1
+
+    # Divergence checks
+    E_o,eta_o,rho_g_o,rho_s_o=E_n[i0:i1],eta_n[i0:i1],rho_g_n[i0:i1],rho_s_n[i0:i1]
+    if np.isnan(np.amax(E_o)) or np.amin(E_o)<=0:
+        return 2, ign
+    elif np.amax(eta_o)>1.0 or np.amin(eta_o)<-10**(-9):
+        return 3, ign
+    elif species and (min(np.amin(rho_g_o), np.amin(rho_s_o))<-10\
+        or np.isnan(max(np.amax(rho_g_o), np.amax(rho_s_o)))):
+        return 4, ign
+    return 0, ign
+
+# Advance up to nsteps time steps (serial); stops early on error, ignition
+# or once elapsed time reaches t_stop
+# Returns steps taken, time elapsed, last time step, error code and ignition flag
+@njit(cache=True)
+def advance(nsteps, t_stop, ign, y, y_new, props, geom, faces, dx, opt, prm):
+    t,dt,err=0.0,0.0,0
+    T,T_guess=props[0],props[7]
+    for nt in range(nsteps):
+        dt=calc_props(y, props, geom, opt, prm)
+        if prm[DT]>0:
+            dt=min(prm[DT], dt)
+        if np.isnan(dt) or dt<=0:
+            return nt, t, dt, 1, ign
+        ign_0=ign
+        err,ign=euler_step(dt, ign, y, y_new, props, geom, faces, dx, opt, prm)
+        for j in range(len(y)):
+            y[j][:]=y_new[j]
+        T_guess[:]=T
+        t+=dt
+        if err>0 or ign!=ign_0 or t>=t_stop:
+            return nt+1, t, dt, err, ign
+
+    return nsteps, t, dt, err, ign
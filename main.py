@@ -15,13 +15,27 @@ This file contains the main executable script for solving 1D conduction:
         python main.py [Input file name+extension] [Output directory relative to current directory]
     -Calculates the time taken to run solver
     -Changes boundary conditions based on ignition criteria
-    -Saves temperature data (.npy) at intervals defined in input file
+    -Saves temperature data (.npy or snapshot container) at intervals defined
+    in input file
     -Saves x grid array (.npy) to output directory
 
 Features:
     -Ignition condition met, will change north BC to that of right BC
     -Saves temperature and reaction data (.npy) depending on input file 
     settings
+    -Ensemble runs (1 process); values separated by ';' in input file for
+    keys in FileClasses.keys_Ensemble give each member; members solved together
+    and each saved to its own directory (1, 2,...) like a single run
+    -Moving window (1 process); after ignition domain follows reaction front
+    and x array saved with each output (X_[time].npy)
+    -Adaptive mesh refinement around reaction front (checked every given number
+    of time steps); x array saved with each output (X_[time].npy)
+    -Reaction front diagnostics (front_tracking.py) each time step after
+    ignition; wave speed fit to front positions over last time steps
+    -Load balancing (checked every given number of time steps); nodes moved
+    between processes from solver time of each process
+    -Checkpoints (checkpoint.py) of full state every given number of time
+    steps and/or minutes; Restart:Checkpoint continues from latest one
 
 """
 
@@ -41,6 +55,10 @@ import GeomClasses as Geom
 import SolverClasses as Solvers
 import FileClasses
 import mpi_routines
+import front_tracking
+import snapshots
+import snapshot_codec
+import checkpoint
 
 ##########################################################################
 # -------------------------------------Beginning
@@ -86,6 +104,28 @@ if rank==0:
 fin=FileClasses.FileIn(input_file, 0)
 fin.Read_Input(settings, Sources, Species, BCs)
 settings['MPI_Processes']=size
+members=settings['Members']
+restart_chk=settings['Restart']=='Checkpoint' # Restart from latest checkpoint
+if members<1:
+    sys.exit('Values for ensemble members must all have the same number of members')
+elif members>1 and size>1:
+    sys.exit('Ensemble runs must be on 1 process')
+if settings['Moving_window']!='None' and (size>1 or members>1 \
+    or settings['bias_type_x']!='None' or (st.find(settings['Restart'], 'None')<0 and not restart_chk)):
+    sys.exit('Moving window must be on 1 process with no biasing, ensemble or restart')
+if settings['AMR']!='None' and (settings['Moving_window']!='None' \
+    or (st.find(settings['Restart'], 'None')<0 and not restart_chk)):
+    sys.exit('Adaptive mesh refinement cannot be used with moving window or restart')
+if settings['Ghost_width']<1 or (settings['Ghost_width']>1 and settings['AMR']!='None'):
+    sys.exit('Ghost_width must be at least 1 (and 1 with adaptive mesh refinement)')
+if settings['Load_balance']!='None' and settings['AMR']!='None':
+    sys.exit('Load balancing cannot be used with adaptive mesh refinement')
+codec=snapshot_codec.codec_setting(settings['Snapshot_codec'])
+if codec is None or (codec!='None' and settings['Output_format']!='npy'):
+    sys.exit('Snapshot codec must be [float64/float32],[None/zlib/lzma],[eta error bound/None] with npy output')
+if settings['Output_format']=='memmap' and (settings['Moving_window']!='None' \
+    or settings['AMR']!='None'):
+    sys.exit('Memory-mapped output cannot be used with moving window or adaptive mesh refinement')
 try:
     os.chdir(settings['Output_directory'])
 except:
@@ -96,6 +136,21 @@ except:
         err=1
     err=comm.bcast(err, root=0) # Way of syncing processes
     os.chdir(settings['Output_directory'])
+# Ensemble members; settings of each as single run and BCs of each
+if members>1:
+    member_input=[FileClasses.ensemble_member(settings, Sources, BCs, i) for i in range(members)]
+    BCs_solver=[member_input[i][2] for i in range(members)]
+    for i in range(members):
+        if not os.path.isdir(mpi_routines.member_dir(i)):
+            os.makedirs(mpi_routines.member_dir(i))
+    # Per-member values as column arrays (broadcast along nodes)
+    for dic in [settings, Sources]:
+        for i in FileClasses.keys_Ensemble:
+            if i in dic and type(dic[i]) is list:
+                dic[i]=np.array(dic[i]).reshape(-1,1)
+else:
+    member_input=[(settings, Sources, BCs)]
+    BCs_solver=copy.deepcopy(BCs)
 #print '****Rank: %i has read input file'%(rank)
 ##########################################################################
 # -------------------------------------Initialize solver and domain
@@ -105,20 +160,27 @@ if rank==0:
     print 'Initializing geometry package...'
 domain=Geom.OneDimLine(settings, Species, 'Solid', rank)
 domain.mesh()
-hx=domain.CV_dim()
 if rank==0:
     print '################################'
     print 'Initializing MPI and solvers...'
-    np.save('X', domain.X, False)
+    if members>1:
+        for i in range(members):
+            np.save(os.path.join(mpi_routines.member_dir(i), 'X'), domain.X, False)
+    else:
+        np.save('X', domain.X, False)
 mpi=mpi_routines.MPI_comms(comm, rank, size, Sources, Species)
 err=mpi.MPI_discretize(domain)
 if err>0:
     sys.exit('Problem discretizing domain into processes')
 #print '****Rank: %i, x array : '%(rank)+str(domain.X)
-hx=mpi.split_var(hx, domain)
 
 domain.create_var(Species)
-solver=Solvers.OneDimLineSolve(domain, settings, Sources, copy.deepcopy(BCs), 'Solid', size, comm)
+solver=Solvers.OneDimLineSolve(domain, settings, Sources, BCs_solver, 'Solid', size, comm)
+if solver.RK.Nk<0:
+    sys.exit('Problem with time scheme')
+# Ghost nodes of multi-stage and implicit schemes need exchanges within a step
+if settings['Ghost_width']>1 and (solver.RK.Nk>1 or solver.theta>0):
+    sys.exit('Ghost_width above 1 needs a single-stage explicit time scheme (Explicit or Strang_split)')
 if rank==0:
     print '################################'
     print 'Initializing domain...'
@@ -126,44 +188,76 @@ if rank==0:
 time_max='0.000000'
 T=300*np.ones_like(domain.E)
 #T=np.linspace(300, 600, len(domain.E))
+# Snapshot container or store (appended to on restart); store has rows for
+# data outputs, initial data, ignition and abort; background writer and
+# codec of npy files if set
+mpi.open_snapshots(settings['Output_format'], st.find(settings['Restart'], 'None')<0,\
+                   members, settings['Number_Data_Output']+3, settings['Async_output'], codec)
+# Restart from latest checkpoint; state of this process as saved
+if restart_chk:
+    chk_number,chk_state=checkpoint.load(comm)
+    if chk_state is None:
+        sys.exit('Cannot find a checkpoint (from same number of processes) to restart a simulation with')
+    mpi.restore_state(chk_state['mpi'])
+    domain.restore_state(chk_state['domain'])
+    solver.restore_state(chk_state['solver'])
+    time_max=snapshots.time_str(chk_state['loop']['t'])
+    # Outputs after checkpoint (earlier run) removed from container/store
+    mpi.truncate_snapshots(chk_state['loop']['t'])
 # Restart from previous data
-if st.find(settings['Restart'], 'None')<0:
-    times=os.listdir('.')
-    i=len(times)
-    if i<2:
-        sys.exit('Cannot find a file to restart a simulation with')
-    j=0
-    while i>j:
-        if st.find(times[j],'T')==0 and st.find(times[j],'.npy')>0 \
-            and st.find(times[j],str(settings['Restart']))>=0:
-            times[j]=st.split(st.split(times[j],'_')[1],'.npy')[0]
-#            if st.find(times[j],str(settings['Restart']))>=0:
-            time_max=times[j]
-            j+=1
-            break
+elif st.find(settings['Restart'], 'None')<0:
+    # Snapshot container/store; output with time containing restart string
+    if settings['Output_format']!='npy':
+        if members>1:
+            rec=snapshots.read_index(mpi_routines.member_dir(0))
         else:
-            del times[j]
-            i-=1
+            rec=snapshots.read_index('.')
+        rec=snapshots.find_record(rec, settings['Restart'])
+        if rec is None:
+            sys.exit('Cannot find a snapshot to restart a simulation with')
+        time_max=rec['time']
+        # Records after restart time (earlier run) removed
+        mpi.truncate_snapshots(rec['t'])
+    else:
+        if members>1:
+            times=os.listdir(mpi_routines.member_dir(0))
+        else:
+            times=os.listdir('.')
+        i=len(times)
+        if i<2:
+            sys.exit('Cannot find a file to restart a simulation with')
+        j=0
+        while i>j:
+            if st.find(times[j],'T')==0 and (st.find(times[j],'.npy')>0 \
+                or st.find(times[j],snapshot_codec.ext)>0) \
+                and st.find(times[j],str(settings['Restart']))>=0:
+                times[j]=os.path.splitext(st.split(times[j],'_')[1])[0]
+#                if st.find(times[j],str(settings['Restart']))>=0:
+                time_max=times[j]
+                j+=1
+                break
+            else:
+                del times[j]
+                i-=1
     
-    T=np.load('T_'+time_max+'.npy')
-    T=mpi.split_var(T, domain)
+    T=mpi.load_var('T', time_max, domain)
     if st.find(Sources['Source_Kim'],'True')>=0:
-        eta=np.load('eta_'+time_max+'.npy')
-        domain.eta=mpi.split_var(eta, domain)
-        del eta
+        domain.eta=mpi.load_var('eta', time_max, domain)
     if domain.model=='Species':
-        P=np.load('P_'+time_max+'.npy')
-        domain.P=mpi.split_var(P, domain)
+        domain.P=mpi.load_var('P', time_max, domain)
         species=['g','s']
         for i in range(len(species)):
-            rho_species=np.load('rho_'+species[i]+'_'+time_max+'.npy')
-            domain.rho_species[species[i]]=mpi.split_var(rho_species, domain)
-        del rho_species, P
+            domain.rho_species[species[i]]=mpi.load_var('rho_'+species[i], time_max, domain)
     
-rhoC=domain.calcProp(T_guess=T, init=True)
-
-domain.E=rhoC*T
-del rhoC,T
+if not restart_chk:
+    rhoC=domain.calcProp(T_guess=T, init=True)
+    domain.E=rhoC*T
+    del rhoC
+    if domain.window is not None:
+        domain.init_window()
+    if domain.amr is not None:
+        domain.init_amr()
+del T
 #print 'Rank %i has initialized'%(rank)
 ###########################################################################
 ## ------------------------Write Input File settings to output directory (only process 0)
@@ -174,24 +268,35 @@ if rank==0:
     #datTime=str(datetime.date(datetime.now()))+'_'+'{:%H%M}'.format(datetime.time(datetime.now()))
     isBinFile=False
     
-    input_file=FileClasses.FileOut('Input_file', isBinFile)
-    
-    # Write header to file
-    input_file.header_cond('INPUT')
-    
-    # Write input file with settings
-    input_file.input_writer_cond(settings, Sources, Species, BCs)
+    # One input file for each ensemble member (in its directory)
+    input_files=[]
+    for i in range(members):
+        if members>1:
+            input_file=FileClasses.FileOut('Input_file', isBinFile, mpi_routines.member_dir(i))
+        else:
+            input_file=FileClasses.FileOut('Input_file', isBinFile)
+        
+        # Write header to file
+        input_file.header_cond('INPUT')
+        
+        # Write input file with settings
+        input_file.input_writer_cond(member_input[i][0], member_input[i][1], Species, member_input[i][2])
+        input_files.append(input_file)
     print '################################\n'
 
     print 'Saving data to numpy array files...'
-mpi.save_data(domain, time_max)
+if not restart_chk:
+    mpi.save_data(domain, float(time_max)/1000)
 
 ###########################################################################
 ## -------------------------------------Solve
 ###########################################################################
-t,nt,tign=float(time_max)/1000,0,0 # time, number steps and ignition time initializations
-v_0,v_1,v,N=0,0,0,0 # combustion wave speed variables initialization
-dx=mpi.compile_var(domain.dx, domain)
+t,nt=float(time_max)/1000,0 # time and number steps initializations
+tign=np.zeros(members) # ignition time of each member
+front=front_tracking.Front_tracker(comm, size, domain, settings['Speed_window']) # Combustion wave diagnostics
+nt_regrid=0 # Time step of next mesh refinement check
+nt_balance=settings['Load_balance'] # Time step of next load balancing
+time_solve=0 # Solver time of this process since last load balancing
 
 # Setup intervals to save data
 output_data_t,output_data_nt=0,0
@@ -204,35 +309,50 @@ elif settings['total_time']=='None':
     settings['total_time']=settings['total_time_steps']*10**12
     t_inc=0
 
-# Ignition conditions
+# Ignition conditions (array of each member for ensemble)
 ign,ign_0=0,0
+if members>1:
+    ign=np.zeros(members, dtype=int)
+
+# Checkpoints; loop variables continued from checkpoint on restart
+checkpointer=checkpoint.Checkpointer(comm, settings['Checkpoint'])
+loop_names=['t','nt','dt','ign','tign','t_inc','nt_regrid','nt_balance']
+dt=0.0
+if restart_chk:
+    checkpointer.number=chk_number
+    checkpointer.nt_next=chk_state['loop']['nt']+checkpointer.steps
+    front.restore_state(chk_state['front'])
+    t,nt,dt,ign,tign,t_inc,nt_regrid,nt_balance=[chk_state['loop'][i] for i in loop_names]
+    del chk_state
 
 if rank==0:
     print 'Solving:'
 while nt<settings['total_time_steps'] and t<settings['total_time']:
-    # First point in calculating combustion propagation speed
 #    T_0=domain.calcProp()[0]
 #    print 'Rank %i has reached while loop'%(rank)
-    if st.find(Sources['Source_Kim'],'True')>=0 and ign==1:
-        eta=mpi.compile_var(domain.eta, domain)
-        if rank==0:
-            v_0=np.sum(eta*dx)
-       
-    # Update ghost nodes
-    mpi.update_ghosts(domain)
+    # Update ghost nodes (if exchange started at end of last time step)
+    mpi.finish_ghosts(domain)
+    # Steps per solver call (compiled backend); stop at data output and end of run
+    nsteps=int(min(solver.steps_call, settings['total_time_steps']-nt))
+    if output_data_nt!=0:
+        nsteps=min(nsteps, output_data_nt-nt%output_data_nt)
+    t_stop=settings['total_time']
+    if output_data_t!=0:
+        t_stop=min(t_stop, output_data_t*t_inc)
     # Actual solve
-    err,dt,ign=solver.Advance_Soln_Cond(nt, t, hx,ign)
+    # Compute time of this process (waiting in communication left out)
+    time_step=MPI.Wtime()-solver.mpi.time_wait
+    err,dt,ign=solver.Advance_Soln_Cond(nt, t, ign, nsteps, t_stop)
+    time_solve+=MPI.Wtime()-solver.mpi.time_wait-time_step
     t+=dt
-    nt+=1
-    # Check all error codes and send the maximum code to all processes
-    err=comm.reduce(err, op=MPI.MAX, root=0)
-    err=comm.bcast(err, root=0)
-    # Check all ignition codes and send maximum
-    ign_0=ign
-    ign_0=comm.reduce(ign_0, op=MPI.MIN, root=0)
-    ign_0=comm.bcast(ign_0, root=0)
-    ign=comm.reduce(ign, op=MPI.MAX, root=0)
-    ign=comm.bcast(ign, root=0)
+    nt+=solver.nt_taken
+    # Start ghost node exchange once ghost nodes used up (every Ghost_width
+    # time steps); completes while reductions, output and diagnostics are done
+    mpi.step_ghosts(domain, solver.nt_taken)
+    # Maximum error code, ignition flag and checkpoint flag of all processes
+    # and minimum ignition flag in one reduction (with time step of next step
+    # if lagged)
+    err,ign,ign_0,solver.dt_lag,chk_due=mpi.step_reduce(err, ign, solver.dt_local, checkpointer.due(nt))
     
     if err>0:
         if rank==0:
@@ -240,10 +360,11 @@ while nt<settings['total_time_steps'] and t<settings['total_time']:
             print '#################### Error: %i'%(err)
             print 'Error codes: 1-time step, 2-Energy, 3-reaction progress, 4-Species balance'
             print 'Saving data to numpy array files...'
-            input_file.Write_single_line('#################### Solver aborted #######################')
-            input_file.Write_single_line('Time step %i, Time elapsed=%f, error code=%i;'%(nt,t,err))
-            input_file.Write_single_line('Error codes: 1-time step, 2-Energy, 3-reaction progress, 4-Species balance')
-        mpi.save_data(domain, '{:f}'.format(t*1000))
+            for input_file in input_files:
+                input_file.Write_single_line('#################### Solver aborted #######################')
+                input_file.Write_single_line('Time step %i, Time elapsed=%f, error code=%i;'%(nt,t,err))
+                input_file.Write_single_line('Error codes: 1-time step, 2-Energy, 3-reaction progress, 4-Species balance')
+        mpi.save_data(domain, t, nt, dt, ign)
         break
     
     # Output data to numpy files
@@ -251,43 +372,83 @@ while nt<settings['total_time_steps'] and t<settings['total_time']:
         (output_data_t!=0 and (t>=output_data_t*t_inc and t-dt<output_data_t*t_inc)):
         if rank==0:
             print 'Saving data to numpy array files...'
-        mpi.save_data(domain, '{:f}'.format(t*1000))
+        mpi.save_data(domain, t, nt, dt, ign)
         t_inc+=1
         
-    # Change boundary conditions and calculate wave speed
-    if ign==1 and ign_0==0:
+    # Change boundary conditions and calculate wave speed (members that ignited)
+    ign_new=np.flatnonzero(np.logical_and(ign==1, ign_0==0))
+    for i in ign_new:
+        if members>1:
+            BCs_i=solver.BCs.members[i].BCs
+        else:
+            BCs_i=solver.BCs.BCs
         if domain.proc_left<0:
-            solver.BCs.BCs['bc_left_E']=BCs['bc_right_E']#['C', (30, 300), (0,-1)]
+            BCs_i['bc_left_E']=member_input[i][2]['bc_right_E']#['C', (30, 300), (0,-1)]
         if rank==0:
-            input_file.fout.write('##bc_left_E_new:')
-            input_file.Write_single_line(str(solver.BCs.BCs['bc_left_E']))
-            input_file.fout.write('\n')
-            tign=t
-        mpi.save_data(domain, '{:f}'.format(t*1000))
+            input_files[i].fout.write('##bc_left_E_new:')
+            input_files[i].Write_single_line(str(BCs_i['bc_left_E']))
+            input_files[i].fout.write('\n')
+            tign[i]=t
+    if len(ign_new)>0:
+        mpi.save_data(domain, t, nt, dt, ign, ign_new)
         
-    # Second point in calculating combustion propagation speed
-    if st.find(Sources['Source_Kim'],'True')>=0 and ign==1:
-        eta=mpi.compile_var(domain.eta, domain)
-        if rank==0:
-            v_1=np.sum(eta*dx)
-            if (v_1-v_0)/dt>0.001:
-                v+=(v_1-v_0)/dt
-                N+=1
+    # Reaction front diagnostics (members that ignited)
+    if st.find(Sources['Source_Kim'],'True')>=0 and np.any(ign==1):
+        front.update(domain, t, ign)
+    
+    # Move window with reaction front (once ignited)
+    if domain.window is not None and ign==1:
+        solver.Move_window()
+    
+    # Adaptive mesh refinement
+    if domain.amr is not None and nt>=nt_regrid:
+        mpi.finish_ghosts(domain)
+        if solver.Regrid():
+            mpi.update_ghosts(domain)
+        nt_regrid=nt+domain.amr['steps']
+    
+    # Load balancing; nodes moved between processes from solver time of each
+    if nt_balance!='None' and nt>=nt_balance:
+        mpi.finish_ghosts(domain)
+        if mpi.load_balance(domain, time_solve):
+            solver.Remesh()
+        nt_balance=nt+settings['Load_balance']
+        time_solve=0
+    
+    # Checkpoint of full state (ghost nodes up to date)
+    if chk_due:
+        mpi.finish_ghosts(domain)
+        loop=dict(zip(loop_names, [t,nt,dt,ign,tign,t_inc,nt_regrid,nt_balance]))
+        checkpointer.save({'domain': domain.checkpoint_state(), 'solver': solver.checkpoint_state(),\
+                           'front': front.checkpoint_state(), 'mpi': mpi.checkpoint_state(),\
+                           'loop': loop}, nt)
         
+# Complete ghost node exchange still in progress
+mpi.finish_ghosts(domain)
+mpi.close_snapshots()
+speed=front.speed()
 if rank==0:        
     time_end=time.time()
-    input_file.Write_single_line('Final time step size: %f ms'%(dt*1000))
-    print 'Ignition time: %f ms'%(tign*1000)
-    input_file.Write_single_line('Ignition time: %f ms'%(tign*1000))
-    print 'Solver time per 1000 time steps: %f min'%((time_end-time_begin)/60.0*1000/nt)
-    input_file.Write_single_line('Solver time per 1000 time steps: %f min'%((time_end-time_begin)/60.0*1000/nt))
-    input_file.Write_single_line('Total time steps: %i'%(nt))
-    try:
-        print 'Average wave speed: %f m/s'%(v/N)
-        input_file.Write_single_line('Average wave speed: %f m/s'%(v/N))
-        input_file.close()
-    except:
-        print 'Average wave speed: 0 m/s'
-        input_file.Write_single_line('Average wave speed: 0 m/s')
+    for i in range(members):
+        input_file=input_files[i]
+        if members>1:
+            print 'Ensemble member %i (directory %s):'%(i+1, mpi_routines.member_dir(i))
+        input_file.Write_single_line('Final time step size: %f ms'%(dt*1000))
+        print 'Ignition time: %f ms'%(tign[i]*1000)
+        input_file.Write_single_line('Ignition time: %f ms'%(tign[i]*1000))
+        print 'Solver time per 1000 time steps: %f min'%((time_end-time_begin)/60.0*1000/nt)
+        input_file.Write_single_line('Solver time per 1000 time steps: %f min'%((time_end-time_begin)/60.0*1000/nt))
+        input_file.Write_single_line('Total time steps: %i'%(nt))
+        if speed[i]!=0:
+            print 'Average wave speed: %f m/s'%(speed[i])
+            input_file.Write_single_line('Average wave speed: %f m/s'%(speed[i]))
+            input_file.Write_single_line('Wave speed fit over last %i time steps'%(min(front.n[i], front.window)))
+            print 'Front position: %f mm, peak temperature: %f K'%(front.position[i]*1000, front.T_max[i])
+            input_file.Write_single_line('Front position: %f mm'%(front.position[i]*1000))
+            input_file.Write_single_line('Burnt mass: %f kg/m^2'%(front.mass[i]))
+            input_file.Write_single_line('Peak temperature: %f K'%(front.T_max[i]))
+        else:
+            print 'Average wave speed: 0 m/s'
+            input_file.Write_single_line('Average wave speed: 0 m/s')
         input_file.close()
     print('Solver has finished its run')
\ No newline at end of file
@@ -12,12 +12,58 @@ This file contains the MPI routines:
 Features:
     -Ignition condition met, will change north BC to that of right BC
     -Saves temperature and reaction data (.npy) depending on input file 
-    settings
+    settings; variables gathered to process 0 (which saves them) with one
+    Gatherv
+    -Or saves all data in one snapshot container or preallocated memory-mapped
+    store (snapshots.py); each process writes its own nodes with time, time
+    step and ignition state
+    -Optional background writer; values copied to reusable buffers and written
+    to npy files/store by a thread while solver continues (store only if MPI
+    library supports calls from any thread)
+    -Optional snapshot codec for npy output (snapshot_codec.py); reduced
+    precision, quantized eta and compression
+    -Scalars agreed on every time step (time step, error code, ignition)
+    packed in one buffer and reduced with one Allreduce (time step negated so
+    minimum is found with MAX)
+    -Ghost node values of all variables packed in one buffer per neighbour and
+    exchanged with non-blocking sends/receives; exchange for next time step
+    started at end of time step and completed at start of next one, so it
+    overlaps only the reductions and output of the main loop (no solver work
+    on interior nodes meanwhile; Runge-Kutta stages exchange before each stage)
+    -Ghost width (nodes of each neighbour held by a process); nodes near ends
+    of local arrays computed on both processes and ghost nodes exchanged every
+    Ghost_width time steps
+    -Any number of nodes per process; load balancing moves boundaries between
+    processes (weighted by solver time of each process) and redistributes
+    variables
 
 """
 
 import numpy as np
 import string as st
+import os
+from mpi4py import MPI
+import snapshots
+import snapshot_codec
+
+# Output directory of ensemble member i (relative to output directory of run)
+def member_dir(i):
+    return str(i+1)
+
+# Save arrays to npy files, or encoded with snapshot codec (list of (file
+# name without extension, array)); variable name is file name before time
+def save_files(files, codec='None'):
+    for path,dat in files:
+        if codec=='None':
+            np.save(path, dat, False)
+        else:
+            snapshot_codec.save(path, os.path.basename(path).rsplit('_',1)[0], dat, codec)
+
+# Load array saved by save_files (file name without extension)
+def load_file(path):
+    if os.path.isfile(path+snapshot_codec.ext):
+        return snapshot_codec.load(path+snapshot_codec.ext)
+    return np.load(path+'.npy')
 
 class MPI_comms():
     def __init__(self, comm, rank, size, Sources, Species):
@@ -26,32 +72,55 @@ class MPI_comms():
         self.size=size
         self.Sources=Sources
         self.Species=Species
+        self.step_buf=np.zeros(5) # Error code, ignition flag, -ignition flag, -time step, checkpoint flag
+        self.ghost_buf=None # Packed ghost node values
+        self.ghost_req=None # Requests of ghost node exchange in progress
+        self.ghost_steps=0 # Time steps since ghost nodes exchanged
+        self.time_wait=0 # Time in blocking communication of solver (not its work)
+        self.balance_tol=0.05 # Nodes moved only if slowest process is this fraction above mean
+        self.snap=None # Snapshot containers (one per ensemble member) or None
+        self.writer=None # Background writer or None
+        self.codec='None' # Snapshot codec (snapshot_codec.py) or 'None'
         
-    # Function to split global array to processes
+    # Function to split global array to processes (owned nodes plus
+    # Ghost_width nodes of each neighbouring process)
     # Use for MPI_discretize and restart
     def split_var(self, var_global, domain):
-        var_local=np.zeros(2)
-        # Far left domain
-        if self.rank==0:
-            var_local=var_global[:domain.Nx+1]
-        # Far right domain
-        elif self.rank==(self.size-1):
-            var_local=var_global[self.rank*domain.Nx-1:]
-        # Interior domain
-        else:
-            var_local=var_global[self.rank*domain.Nx-1:(self.rank+1)*domain.Nx+1]
+        g=domain.ghosts
+        st_i,en_i=self.bounds[self.rank],self.bounds[self.rank+1]
+        # Ghost nodes on left
+        if self.rank>0:
+            st_i-=g
+        # Ghost nodes on right
+        if self.rank<(self.size-1):
+            en_i+=g
         
-        return var_local
+        return var_global[...,st_i:en_i]
+    
+    # First global node of each process (and total nodes at end); nodes split
+    # so each process has about the same sum of node weights and at least g nodes
+    def partition(self, weight, g):
+        c=np.cumsum(weight)-0.5*weight # Weight up to middle of each node
+        bounds=np.zeros(self.size+1, dtype=int)
+        bounds[1:-1]=np.searchsorted(c, c[-1]*np.arange(1,self.size)/float(self.size))
+        bounds[-1]=len(weight)
+        for i in range(1,self.size):
+            bounds[i]=max(bounds[i], bounds[i-1]+g)
+        for i in range(self.size-1,0,-1):
+            bounds[i]=min(bounds[i], bounds[i+1]-g)
+        return bounds
     
-    # MPI discretization routine
+    # MPI discretization routine; any number of nodes, split evenly
     def MPI_discretize(self, domain):
-        if domain.Nx%self.size!=0:
+        if domain.Nx<self.size*domain.ghosts:
             return 1
-        domain.Nx/=self.size
+        self.bounds=self.partition(np.ones(domain.Nx), domain.ghosts)
+        domain.Nx=self.bounds[self.rank+1]-self.bounds[self.rank] # Nodes owned
         
         # Divide global variables
         domain.X=self.split_var(domain.X, domain)
         domain.dx=self.split_var(domain.dx, domain)
+        domain.hx=self.split_var(domain.hx, domain)
         domain.E=self.split_var(domain.E, domain)
         
         # Identify neighboring processes
@@ -64,99 +133,301 @@ class MPI_comms():
         
         return 0
     
-    # Update ghost nodes for processes
-    def update_ghosts(self, domain):
-        # Send to the left, receive from the right
-        a=np.ones(1)*domain.E[-1]
-        self.comm.Send(domain.E[1], dest=domain.proc_left)
-        self.comm.Recv(a, source=domain.proc_right)
-        domain.E[-1]=a
-        # Send to the right, receive from the left
-        a=np.ones(1)*domain.E[0]
-        self.comm.Send(domain.E[-2], dest=domain.proc_right)
-        self.comm.Recv(a, source=domain.proc_left)
-        domain.E[0]=a
+    # Move nodes between processes so each takes about the same solver time
+    # (compute time of this process since last call, without waiting in
+    # communication); cost of a node is solver time of its process over its
+    # nodes, so boundaries move toward expensive nodes (reaction front).
+    # Nothing moved unless slowest process is balance_tol above mean.
+    # Variables compiled and split with new boundaries (ghost node exchange
+    # must be complete). Returns True if nodes moved
+    def load_balance(self, domain, time_solve):
+        if self.size==1:
+            return False
+        t=np.array(self.comm.allgather(time_solve))
+        if np.amax(t)<=(1+self.balance_tol)*np.mean(t):
+            return False
+        n=np.diff(self.bounds)
+        bounds=self.partition(np.repeat(t/n, n), domain.ghosts)
+        if np.array_equal(bounds, self.bounds):
+            return False
         
+        # State and properties kept between steps, and mesh
+        var=domain.window_vars()+[('X', domain.X), ('dx', domain.dx), ('hx', domain.hx)]
+        dat=self.compile_vars([dat for name,dat in var], domain)
+        var=[(var[i][0], dat[i]) for i in range(len(var))]
+        self.bounds=bounds
+        domain.Nx=bounds[self.rank+1]-bounds[self.rank]
+        for name,dat in var:
+            dat=self.split_var(dat, domain).copy()
+            if name[4:] in domain.rho_species:
+                domain.rho_species[name[4:]]=dat
+            else:
+                setattr(domain, name, dat)
+        domain.geom_cache()
+        domain.active=None
+        self.ghost_steps=0
+        return True
+    
+    # State (checkpoint); nodes of each process and time steps since ghost
+    # nodes exchanged (ghost node exchange must be complete), so next exchange
+    # is at same time step as in run that saved it
+    def checkpoint_state(self):
+        return {'bounds': self.bounds, 'ghost_steps': self.ghost_steps}
+    
+    def restore_state(self, state):
+        self.bounds=state['bounds']
+        self.ghost_steps=state['ghost_steps']
+    
+    # Variables with ghost nodes (exchanged with neighbouring processes);
+    # temperature guess included as properties at ghost nodes depend on it
+    def ghost_vars(self, domain):
+        var=[domain.E, domain.T_guess]
         if st.find(self.Sources['Source_Kim'],'True')>=0:
-            # Send to the left, receive from the right
-            a=np.ones(1)*domain.eta[-1]
-            self.comm.Send(domain.eta[1], dest=domain.proc_left)
-            self.comm.Recv(a, source=domain.proc_right)
-            domain.eta[-1]=a
-            # Send to the right, receive from the left
-            a=np.ones(1)*domain.eta[0]
-            self.comm.Send(domain.eta[-2], dest=domain.proc_right)
-            self.comm.Recv(a, source=domain.proc_left)
-            domain.eta[0]=a
+            var.append(domain.eta)
         if domain.model=='Species':
-            # Send to the left, receive from the right
-            self.comm.Send(domain.P[1], dest=domain.proc_left)
-            a=np.ones(1)*domain.P[-1]
-            self.comm.Recv(a, source=domain.proc_right)
-            domain.P[-1]=a
-            # Send to the right, receive from the left
-            self.comm.Send(domain.P[-2], dest=domain.proc_right)
-            a=np.ones(1)*domain.P[0]
-            self.comm.Recv(a, source=domain.proc_left)
-            domain.P[0]=a
+            var.append(domain.P)
             for i in domain.species_keys:
-                # Send to the left, receive from the right
-                self.comm.Send(domain.rho_species[i][1], dest=domain.proc_left)
-                a=np.ones(1)*domain.rho_species[i][-1]
-                self.comm.Recv(a, source=domain.proc_right)
-                domain.rho_species[i][-1]=a
-                # Send to the right, receive from the left
-                self.comm.Send(domain.rho_species[i][-2], dest=domain.proc_right)
-                a=np.ones(1)*domain.rho_species[i][0]
-                self.comm.Recv(a, source=domain.proc_left)
-                domain.rho_species[i][0]=a
+                var.append(domain.rho_species[i])
+        return var
+    
+    # Start ghost node exchange; values for each neighbour packed in one buffer
+    # and sent/received without blocking (finish_ghosts must be called before
+    # ghost nodes are used or variables changed)
+    def start_ghosts(self, domain):
+        if self.size==1 or self.ghost_req is not None:
+            return
+        var=self.ghost_vars(domain)
+        g=domain.ghosts
+        if self.ghost_buf is None or self.ghost_buf.shape[1]!=len(var):
+            # Rows: send left, send right, receive left, receive right
+            self.ghost_buf=np.zeros((4,len(var),g))
+        buf=self.ghost_buf
+        for j in range(len(var)):
+            buf[0,j]=var[j][g:2*g]
+            buf[1,j]=var[j][-2*g:-g]
+        left,right=domain.proc_left,domain.proc_right
+        if left<0:
+            left=MPI.PROC_NULL
+        if right<0:
+            right=MPI.PROC_NULL
+        # Tags kept apart from other messages (exchange may be in progress
+        # while data is compiled)
+        self.ghost_req=[self.comm.Irecv(buf[2], source=left, tag=11),\
+                        self.comm.Irecv(buf[3], source=right, tag=10),\
+                        self.comm.Isend(buf[0], dest=left, tag=10),\
+                        self.comm.Isend(buf[1], dest=right, tag=11)]
+    
+    # Wait for ghost node exchange in progress (if any) and unpack
+    def finish_ghosts(self, domain):
+        if self.ghost_req is None:
+            return
+        MPI.Request.Waitall(self.ghost_req)
+        self.ghost_req=None
+        self.ghost_steps=0
+        var=self.ghost_vars(domain)
+        g=domain.ghosts
+        buf=self.ghost_buf
+        for j in range(len(var)):
+            if domain.proc_left>=0:
+                var[j][:g]=buf[2,j]
+            if domain.proc_right>=0:
+                var[j][-g:]=buf[3,j]
+    
+    # Update ghost nodes for processes (blocking; time counted as waiting)
+    def update_ghosts(self, domain):
+        t=MPI.Wtime()
+        self.start_ghosts(domain)
+        self.finish_ghosts(domain)
+        self.time_wait+=MPI.Wtime()-t
+    
+    # Count time steps taken since ghost nodes exchanged; exchange started
+    # once ghost nodes are used up (nodes next to ends of local arrays are not
+    # updated correctly, so valid nodes shrink by one each time step)
+    def step_ghosts(self, domain, steps):
+        self.ghost_steps+=steps
+        if self.ghost_steps>=domain.ghosts:
+            self.start_ghosts(domain)
                 
-    # General function to compile a variable from all processes
-    def compile_var(self, var, Domain):
-        var_global=var[:-1].copy()
-        if self.rank==0:
-            for i in range(self.size-1):
-                len_arr=self.comm.recv(source=i+1)
-                dat=np.empty(len_arr)
-                self.comm.Recv(dat, source=i+1)
-                var_global=np.block([var_global, dat])
-        elif (Domain.proc_left>=0) and (Domain.proc_right>=0):
-            len_arr=len(var)-2
-            self.comm.send(len_arr, dest=0)
-            self.comm.Send(var[1:-1], dest=0)
+    # Smallest time step of all processes (0 if not a number on any process)
+    def min_dt(self, dt):
+        if self.size==1:
+            return dt
+        buf=self.step_buf[3:4]
+        buf[0]=dt
+        if np.isnan(dt):
+            buf[0]=0
+        t=MPI.Wtime()
+        self.comm.Allreduce(MPI.IN_PLACE, buf, op=MPI.MIN)
+        self.time_wait+=MPI.Wtime()-t
+        return buf[0]
+    
+    # Largest values of buffer (in place) over all processes; time counted
+    # as waiting
+    def max_all(self, buf):
+        t=MPI.Wtime()
+        self.comm.Allreduce(MPI.IN_PLACE, buf, op=MPI.MAX)
+        self.time_wait+=MPI.Wtime()-t
+        return buf
+    
+    # Largest error code, ignition flag and checkpoint flag of all processes,
+    # smallest ignition flag and smallest time step (time step of next step
+    # when lagged; inf if not needed)
+    def step_reduce(self, err, ign, dt=np.inf, flag=0):
+        if self.size==1:
+            return err, ign, ign, dt, flag
+        buf=self.step_buf
+        buf[0]=err
+        buf[1]=ign
+        buf[2]=-ign
+        buf[3]=-dt
+        if np.isnan(dt):
+            buf[3]=0
+        buf[4]=flag
+        self.comm.Allreduce(MPI.IN_PLACE, buf, op=MPI.MAX)
+        return int(buf[0]), int(buf[1]), -int(buf[2]), -buf[3], int(buf[4])
+    
+    # Compile several variables from all processes in one collective; owned
+    # nodes of each packed in rows of one array, rows of global array returned
+    # Only process 0 gets global arrays if root_only (None on other processes)
+    def compile_vars(self, var, Domain, root_only=False):
+        own=Domain.owned()
+        buf=np.array([dat[...,own] for dat in var], dtype=float)
+        counts=np.array(self.comm.allgather(buf.shape[-1]))
+        if root_only:
+            var_global,recv=None,None
+            if self.rank==0:
+                var_global=np.empty(len(var)*sum(counts))
+                recv=[var_global, counts*len(var)]
+            self.comm.Gatherv(buf, recv, root=0)
+            if self.rank!=0:
+                return [None]*len(var)
         else:
-            len_arr=len(var)-1
-            self.comm.send(len_arr, dest=0)
-            self.comm.Send(var[1:], dest=0)
-        len_arr=self.comm.bcast(len(var_global), root=0)
-        if self.rank!=0:
-            var_global=np.empty(len_arr)
-        self.comm.Bcast(var_global, root=0)
-        return var_global
+            var_global=np.empty(len(var)*sum(counts))
+            self.comm.Allgatherv(buf, [var_global, counts*len(var)])
+        # Blocks of each process (rows of its variables) side by side
+        blocks=np.split(var_global, np.cumsum(counts*len(var))[:-1])
+        var_global=np.concatenate([blk.reshape(len(var),-1) for blk in blocks], axis=1)
+        return list(var_global)
         
-    # Function to save data to npy files
-    def save_data(self, Domain, time):
-        # 1 process (serial)
-        if self.size==1:
-            np.save('T_'+time, Domain.calcProp(Domain.T_guess)[0], False)
-            # Kim source term
-            if st.find(self.Sources['Source_Kim'],'True')>=0:
-                np.save('eta_'+time, Domain.eta, False)
-            if Domain.model=='Species':
-                np.save('P_'+time, Domain.P, False)
-                for i in Domain.species_keys:
-                    np.save('rho_'+i+'_'+time, Domain.rho_species[i], False)
-        # More than 1 process
+    # Open snapshot container or memory-mapped store (rows for given number of
+    # outputs) of each ensemble member (Output_format:container or memmap);
+    # outputs appended to existing ones on restart
+    def open_snapshots(self, fmt, append, members=1, outputs=1, buffers='None', codec='None'):
+        self.snap=None
+        self.codec=codec # Snapshot codec of npy files
+        dirs=['.']
+        if members>1:
+            dirs=[member_dir(i) for i in range(members)]
+        if fmt=='container':
+            self.snap=[snapshots.Snapshot_file(self.comm, d, append) for d in dirs]
+        elif fmt=='memmap':
+            self.snap=[snapshots.Snapshot_store(self.comm, d, outputs, append) for d in dirs]
+        # Background writer (npy files, and store if MPI can be called from
+        # any thread; container written by all processes together so written
+        # when saved)
+        self.writer=None
+        if buffers!='None' and (fmt=='npy' or \
+            (fmt=='memmap' and MPI.Query_thread()==MPI.THREAD_MULTIPLE)):
+            self.writer=snapshots.Snapshot_writer(buffers)
+    
+    # Remove records after restart time t [s] from containers/stores
+    def truncate_snapshots(self, t):
+        if self.snap is not None:
+            for snap in self.snap:
+                snap.truncate(t)
+    
+    # Wait for background writer and close containers/stores (end of run)
+    def close_snapshots(self):
+        if self.writer is not None:
+            self.writer.close()
+        if self.snap is not None:
+            for snap in self.snap:
+                snap.close()
+    
+    # Function to save data to npy files or snapshot container (time t [s],
+    # time step number, time step size and ignition flag)
+    # Ensemble members saved to their own directories (members to save; default all)
+    def save_data(self, Domain, t, nt=0, dt=0.0, ign=0, members=None):
+        time=snapshots.time_str(t)
+        # Temperature guess of domain not changed by saving
+        T_guess=Domain.T_guess
+        var=[('T', Domain.calcProp(T_guess.copy())[0])]
+        Domain.T_guess=T_guess
+        # Kim source term
+        if st.find(self.Sources['Source_Kim'],'True')>=0:
+            var.append(('eta', Domain.eta))
+        if Domain.model=='Species':
+            var.append(('P', Domain.P))
+            for i in Domain.species_keys:
+                var.append(('rho_'+i, Domain.rho_species[i]))
+        if members is None:
+            members=range(Domain.members)
+        # Moving window; x of nodes saved and burnt nodes behind window put first
+        if Domain.window is not None:
+            var.append(('X', Domain.X))
+            var=[(name, np.concatenate(Domain.archive[name]+[dat])) for name,dat in var]
+        # Adaptive mesh; x of nodes saved
+        elif Domain.amr is not None:
+            var.append(('X', Domain.X))
+        
+        # Snapshot container/store; each process writes its own nodes
+        if self.snap is not None:
+            if self.size>1:
+                own=Domain.owned()
+                var=[(name, dat[...,own]) for name,dat in var]
+            ign=np.broadcast_to(ign, (Domain.members,))
+            for i in members:
+                # Mesh (x) shared by ensemble members
+                var_i=var
+                if Domain.members>1:
+                    var_i=[(name, dat[i] if np.ndim(dat)>1 else dat) for name,dat in var]
+                if self.writer is None:
+                    self.snap[i].write(var_i, t, nt, dt, ign[i])
+                    continue
+                # Store; rows found here (with communication), values written
+                # in background (waits for earlier outputs if rows reallocated)
+                if self.snap[i].row==self.snap[i].N:
+                    self.writer.flush()
+                row,st_i=self.snap[i].prepare(var_i)
+                self.writer.submit(var_i, self.snap[i].write_row, row, st_i, t, nt, dt, ign[i])
+            return
+        
+        # More than 1 process; all variables gathered to process 0 in one
+        # call, which saves them
+        if self.size>1:
+            dat=self.compile_vars([dat for name,dat in var], Domain, root_only=True)
+            if self.rank!=0:
+                return
+            var=[(var[i][0], dat[i]) for i in range(len(var))]
+        
+        files=[]
+        for name,dat in var:
+            # Mesh (x) shared by ensemble members
+            if Domain.members>1 and np.ndim(dat)>1:
+                for i in members:
+                    files.append((os.path.join(member_dir(i), name+'_'+time), dat[i]))
+            elif Domain.members>1:
+                for i in members:
+                    files.append((os.path.join(member_dir(i), name+'_'+time), dat))
+            else:
+                files.append((name+'_'+time, dat))
+        if self.writer is None:
+            save_files(files, self.codec)
+        else:
+            self.writer.submit(files, save_files, self.codec)
+    
+    # Load variable saved at given time (restart) and split to processes
+    def load_var(self, name, time, Domain):
+        dirs=['.']
+        if Domain.members>1:
+            dirs=[member_dir(i) for i in range(Domain.members)]
+        if self.snap is not None:
+            var=[snapshots.read_var(snapshots.find_record(snapshots.read_index(d), time), name, d)\
+                 for d in dirs]
+        else:
+            var=[load_file(os.path.join(d, name+'_'+time)) for d in dirs]
+        if Domain.members>1:
+            var=np.array(var)
         else:
-            T=self.compile_var(Domain.calcProp(Domain.T_guess)[0], Domain)
-            np.save('T_'+time, T, False)
-            # Kim source term
-            if st.find(self.Sources['Source_Kim'],'True')>=0:
-                eta=self.compile_var(Domain.eta, Domain)
-                np.save('eta_'+time, eta, False)
-            if Domain.model=='Species':
-                P=self.compile_var(Domain.P, Domain)
-                np.save('P_'+time, P, False)
-                for i in Domain.species_keys:
-                    m_i=self.compile_var(Domain.rho_species[i], Domain)
-                    np.save('rho_'+i+'_'+time, m_i, False)
\ No newline at end of file
+            var=var[0]
+        return self.split_var(var, Domain)
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains the snapshot codec (Snapshot_codec setting; npy output):
+    -reduced precision; float32 instead of float64
+    -eta quantized to steps of twice a given error bound (unsigned integers)
+    -lossless compression (zlib or lzma from standard library) of chunks of
+    nodes; chunk index in file so a range of nodes is decoded on its own
+    -encoded files replace .npy files ([variable]_[time].snp)
+
+File layout:
+    -magic (8 bytes), header of 8 float64 (nodes, nodes per chunk, chunks,
+    data type code, compressor code, quantization step, 0, 0)
+    -chunk index; (chunks, 2) int64 of byte offset (from end of index) and
+    length of each chunk
+    -chunks
+
+Features/assumptions:
+    -lzma is not in the standard library of Python 2; codec_setting returns
+    None if it is chosen but cannot be imported
+
+"""
+
+import numpy as np
+import zlib
+try:
+    import lzma
+except ImportError:
+    lzma=None
+
+ext='.snp'
+magic=b'NTCODEC1'
+N_HEAD=8
+CHUNK=65536 # Nodes per chunk
+
+# Data type codes
+dtypes=[np.float64, np.float32, np.uint16, np.uint32]
+F64, F32, Q16, Q32=0,1,2,3
+# Compressor codes
+compressors=['None', 'zlib', 'lzma']
+
+# Codec from setting ([precision],[compressor],[eta error bound]; e.g.
+# float32,zlib,1e-6); 'None' for plain .npy files; returns None if not valid
+def codec_setting(setting):
+    if setting=='None':
+        return 'None'
+    opt=setting.split(',')
+    if len(opt)!=3 or opt[0] not in ['float64','float32'] or opt[1] not in compressors\
+        or (opt[1]=='lzma' and lzma is None):
+        return None
+    codec={'dtype': [F64,F32][opt[0]=='float32'], 'comp': compressors.index(opt[1]), 'eta': None}
+    if opt[2]!='None':
+        codec['eta']=float(opt[2])
+    return codec
+
+def compress(data, comp):
+    if comp==1:
+        return zlib.compress(data, 1)
+    elif comp==2:
+        return lzma.compress(data, preset=1)
+    return data
+
+def decompress(data, comp):
+    if comp==1:
+        return zlib.decompress(data)
+    elif comp==2:
+        return lzma.decompress(data)
+    return data
+
+# Encode variable (1D array) with codec and save in path (without extension);
+# eta quantized if error bound given
+def save(path, name, dat, codec):
+    dat=np.asarray(dat, dtype=float)
+    step=0.0
+    code=codec['dtype']
+    # Quantized eta (if steps fit in 32 bit integers)
+    if name=='eta' and codec['eta'] is not None and 0.5/codec['eta']<=np.iinfo(np.uint32).max:
+        step=2*codec['eta']
+        code=[Q16,Q32][1/step>np.iinfo(np.uint16).max]
+        q=np.round(np.clip(dat, 0, 1)/step)
+        dat=q.astype(dtypes[code])
+    else:
+        dat=dat.astype(dtypes[code])
+
+    chunks=[compress(dat[i:i+CHUNK].tobytes(), codec['comp']) for i in range(0, len(dat), CHUNK)]
+    index=np.zeros((len(chunks),2), dtype=np.int64)
+    index[:,1]=[len(c) for c in chunks]
+    index[1:,0]=np.cumsum(index[:-1,1])
+    head=np.zeros(N_HEAD)
+    head[:6]=len(dat), CHUNK, len(chunks), code, codec['comp'], step
+    with open(path+ext, 'wb') as f:
+        f.write(magic)
+        f.write(head.tobytes())
+        f.write(index.tobytes())
+        for c in chunks:
+            f.write(c)
+
+# Decode variable saved in file at given nodes (slice; default all); only
+# chunks with those nodes are read and decompressed
+def load(path, nodes=slice(None)):
+    with open(path, 'rb') as f:
+        if f.read(len(magic))!=magic:
+            raise IOError('Not a snapshot codec file: '+path)
+        head=np.frombuffer(f.read(N_HEAD*8), dtype=float)
+        n,chunk,nchunk,code,comp=[int(i) for i in head[:5]]
+        step=head[5]
+        index=np.frombuffer(f.read(nchunk*16), dtype=np.int64).reshape(-1,2)
+        start=f.tell()
+        st_i,en_i,inc=nodes.indices(n)
+        if en_i<=st_i:
+            return np.zeros(0)
+        c0,c1=st_i//chunk,(en_i-1)//chunk+1
+        dat=[]
+        for i in range(c0, c1):
+            f.seek(start+index[i,0])
+            dat.append(np.frombuffer(decompress(f.read(index[i,1]), comp), dtype=dtypes[code]))
+    dat=np.concatenate(dat)[st_i-c0*chunk:en_i-c0*chunk:inc].astype(float)
+    if step>0:
+        dat*=step
+    return dat
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains the snapshot container (Output_format:container) and
+memory-mapped store (Output_format:memmap):
+    -container; all variables and output times of a run in one file
+    (file_name); each process writes its own nodes directly into the file
+    (MPI-IO, one collective write per output); no gather to process 0
+    -store; one file per variable preallocated for all outputs (rows) at
+    all nodes, and one file of output times; each output written in place
+    into its row (each process writes its own nodes with MPI-IO at explicit
+    offsets; process 0 writes output times through np.memmap); files synced
+    when closed, not after each output
+    -background writer; outputs copied into a ring of reusable buffers and
+    written by a thread while the solver continues (npy files, and store if
+    MPI supports calls from several threads; communication done before
+    values are handed over)
+    -readers for post-processing and restart (NumPy only); outputs listed as
+    records (same for both) and variables read for one output, lazily for a
+    range of nodes
+
+Container layout:
+    -magic (8 bytes), then records one after another
+    -record: header of 8 float64 (time [s], time step number, time step size,
+    ignition flag, nodes, number of variables, 0, 0), variable names (16 bytes
+    each), then values of each variable at all nodes (float64)
+    -number of nodes may change between records (moving window, AMR)
+
+Store layout:
+    -Store_times.dat; (outputs, 4) float64 of time [s], time step number,
+    time step size and ignition flag (NaN in rows not written yet)
+    -Store_[variable].dat; (outputs, nodes) float64
+    -number of nodes fixed; rows doubled if more outputs than preallocated
+
+Features/assumptions:
+    -mpi4py only needed to write; if it cannot be imported, files can still be
+    read
+    -records (rows) appended to existing files on restart; those after the
+    restart time (and a partly written container record) removed first
+
+"""
+
+import numpy as np
+import os
+import threading
+import atexit
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from mpi4py import MPI
+except ImportError:
+    MPI=None
+
+file_name='Snapshots.dat'
+magic=b'NTSNAP01'
+N_HEAD=8 # float64 values in record header
+LEN_NAME=16 # bytes per variable name
+store_prefix='Store_'
+N_TIME=4 # Values in each row of times in store
+
+# Time in data file names (ms) from time in seconds
+def time_str(t):
+    return '{:f}'.format(t*1000)
+
+class Snapshot_file():
+    # Open container in given directory; new file unless appending (restart)
+    def __init__(self, comm, directory='.', append=False):
+        self.comm=comm
+        self.dir=directory
+        path=os.path.join(directory, file_name)
+        if not append and comm.Get_rank()==0 and os.path.isfile(path):
+            os.remove(path)
+        comm.Barrier()
+        self.fh=MPI.File.Open(comm, path, MPI.MODE_WRONLY|MPI.MODE_CREATE)
+        self.offset=self.fh.Get_size()
+        if self.offset==0:
+            if comm.Get_rank()==0:
+                self.fh.Write_at(0, np.frombuffer(magic, dtype=np.uint8))
+            self.offset=len(magic)
+
+    # Write one record; var is list of (name, values at nodes of this
+    # process); processes write their nodes in order of rank
+    def write(self, var, t, nt=0, dt=0.0, ign=0):
+        buf=np.array([dat for name,dat in var], dtype=float)
+        n=buf.shape[-1]
+        st_i=self.comm.exscan(n)
+        if st_i is None:
+            st_i=0
+        Nx=self.comm.allreduce(n)
+
+        # Header (process 0)
+        head=np.zeros(N_HEAD)
+        head[:6]=t, nt, dt, ign, Nx, len(var)
+        names=np.array([name for name,dat in var], dtype='S%i'%LEN_NAME)
+        head=head.tobytes()+names.tobytes()
+        self.fh.Set_view(0, MPI.BYTE, MPI.BYTE)
+        if self.comm.Get_rank()==0:
+            self.fh.Write_at(self.offset, np.frombuffer(head, dtype=np.uint8))
+
+        # Values; nodes of this process in each variable with one file view
+        ftype=MPI.DOUBLE.Create_subarray([len(var),Nx], [len(var),n], [0,st_i])
+        ftype.Commit()
+        self.fh.Set_view(self.offset+len(head), MPI.DOUBLE, ftype)
+        self.fh.Write_all(buf)
+        ftype.Free()
+        self.offset+=len(head)+buf.itemsize*len(var)*Nx
+
+    # Remove records after time t [s] and any partly written record (restart);
+    # new records written after last one kept
+    def truncate(self, t):
+        offset=len(magic)
+        if self.comm.Get_rank()==0:
+            for rec in read_index_file(self.dir):
+                if rec['t']>t:
+                    break
+                offset=rec['end']
+        self.offset=self.comm.bcast(offset, root=0)
+        self.fh.Set_size(self.offset)
+    
+    def close(self):
+        self.fh.Close()
+
+class Snapshot_store():
+    # Store in given directory with rows for N outputs (created on first
+    # output); rows appended after those already written on restart
+    # Times kept by process 0 (memory map); variables written by each process
+    # at its own offsets with MPI-IO, so processes never share a mapped page
+    def __init__(self, comm, directory='.', N=1, append=False):
+        self.comm=comm
+        self.rank=comm.Get_rank()
+        self.dir=directory
+        self.fields={}
+        self.times=None
+        rows=None
+        if self.rank==0:
+            path=self.path('times')
+            if not append or not os.path.isfile(path):
+                for name in os.listdir(directory):
+                    if name.startswith(store_prefix):
+                        os.remove(os.path.join(directory, name))
+                times=np.memmap(path, dtype=float, mode='w+', shape=(N,N_TIME))
+                times[:]=np.nan
+                del times
+            self.times=np.memmap(path, dtype=float, mode='r+').reshape(-1,N_TIME)
+            rows=len(self.times), int(np.sum(~np.isnan(self.times[:,0])))
+        self.N,self.row=comm.bcast(rows, root=0) # Rows and next row to write
+        self.Nx=None
+
+    def path(self, name):
+        return os.path.join(self.dir, store_prefix+name+'.dat')
+
+    # MPI file of variable, sized for all rows (collective)
+    def field(self, name):
+        if name not in self.fields:
+            fh=MPI.File.Open(self.comm, self.path(name), MPI.MODE_WRONLY|MPI.MODE_CREATE)
+            if fh.Get_size()<self.N*self.Nx*8:
+                fh.Set_size(self.N*self.Nx*8)
+            self.fields[name]=fh
+        return self.fields[name]
+
+    # Double rows of all files (more outputs than preallocated)
+    def grow(self):
+        N=2*self.N
+        for fh in self.fields.values():
+            fh.Set_size(N*self.Nx*8)
+        if self.rank==0:
+            self.times.flush()
+            self.times=None
+            with open(self.path('times'), 'r+b') as f:
+                f.truncate(N*N_TIME*8)
+            self.times=np.memmap(self.path('times'), dtype=float, mode='r+', shape=(N,N_TIME))
+            self.times[self.N:]=np.nan
+        self.N=N
+
+    # Remove rows after time t [s] (restart); rows written in order of time, so
+    # rows kept come first
+    def truncate(self, t):
+        row=None
+        if self.rank==0:
+            self.times[self.times[:,0]>t]=np.nan
+            self.times.flush()
+            row=int(np.sum(~np.isnan(self.times[:,0])))
+        self.row=self.comm.bcast(row, root=0)
+
+    # Write one output in next row; var is list of (name, values at nodes of
+    # this process); processes write their nodes in order of rank
+    def write(self, var, t, nt=0, dt=0.0, ign=0):
+        row,st_i=self.prepare(var)
+        self.write_row(var, row, st_i, t, nt, dt, ign)
+    
+    # Row and first node of this process for next output (all processes);
+    # files grown/created as needed
+    def prepare(self, var):
+        n=len(var[0][1])
+        st_i=self.comm.exscan(n)
+        if st_i is None:
+            st_i=0
+        if self.Nx is None:
+            self.Nx=self.comm.allreduce(n)
+        if self.row==self.N:
+            self.grow()
+        for name,dat in var:
+            self.field(name)
+        self.row+=1
+        return self.row-1, st_i
+    
+    # Write values into row (no communication; may be done by background writer)
+    def write_row(self, var, row, st_i, t, nt=0, dt=0.0, ign=0):
+        for name,dat in var:
+            fh=self.fields[name]
+            fh.Write_at(8*(row*self.Nx+st_i), np.ascontiguousarray(dat, dtype=float))
+        if self.rank==0:
+            self.times[row]=t, nt, dt, ign
+
+    # Data written to disk at end of run (not after each output)
+    def close(self):
+        for fh in self.fields.values():
+            fh.Close()
+        self.fields={}
+        if self.rank==0:
+            self.times.flush()
+
+class Snapshot_writer():
+    # Background thread writing outputs; values copied into one of n_buf
+    # reusable buffers (waits for a free buffer if all are being written)
+    def __init__(self, n_buf=2):
+        self.free=queue.Queue()
+        for i in range(n_buf):
+            self.free.put({})
+        self.jobs=queue.Queue()
+        self.error=None
+        self.thread=threading.Thread(target=self.run)
+        self.thread.daemon=True
+        self.thread.start()
+        atexit.register(self.close) # Outputs in progress written on exit
+    
+    # Copy values (list of (name, array)) to a free buffer and call
+    # func(values, *args) in background
+    def submit(self, var, func, *args):
+        self.check()
+        buf=self.free.get()
+        var_buf=[]
+        # Arrays of buffer by position in var (names may change each output,
+        # e.g. file paths with time)
+        for j in range(len(var)):
+            name,dat=var[j]
+            if j not in buf or np.shape(buf[j])!=np.shape(dat):
+                buf[j]=np.empty(np.shape(dat))
+            buf[j][...]=dat
+            var_buf.append((name, buf[j]))
+        self.jobs.put((buf, var_buf, func, args))
+    
+    def run(self):
+        while True:
+            job=self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            buf,var,func,args=job
+            try:
+                func(var, *args)
+            except Exception as e:
+                self.error=e
+            self.free.put(buf)
+            self.jobs.task_done()
+    
+    # Raise error from background thread
+    def check(self):
+        if self.error is not None:
+            error,self.error=self.error,None
+            raise error
+    
+    # Wait for outputs submitted so far
+    def flush(self):
+        self.jobs.join()
+        self.check()
+    
+    def close(self):
+        if self.thread.is_alive():
+            self.jobs.put(None)
+            self.thread.join()
+        self.check()
+
+# Outputs saved in directory (container or store); list of dictionaries
+# with time, time step number, time step size, ignition flag, nodes, time
+# string (as in data file names) and where each variable is saved
+def read_index(directory='.'):
+    if os.path.isfile(os.path.join(directory, store_prefix+'times.dat')):
+        return read_index_store(directory)
+    return read_index_file(directory)
+
+# Outputs in container; variables saved as byte offsets, and end of each
+# record (only completely written records)
+def read_index_file(directory='.'):
+    records=[]
+    path=os.path.join(directory, file_name)
+    size=os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if f.read(len(magic))!=magic:
+            return records
+        while True:
+            head=f.read(N_HEAD*8)
+            if len(head)<N_HEAD*8:
+                break
+            head=np.frombuffer(head, dtype=float)
+            Nx,nvar=int(head[4]),int(head[5])
+            names=np.frombuffer(f.read(nvar*LEN_NAME), dtype='S%i'%LEN_NAME)
+            start=f.tell()
+            if start+nvar*Nx*8>size:
+                break # Record not completely written
+            rec={'t': head[0], 'nt': int(head[1]), 'dt': head[2], 'ign': int(head[3]),\
+                 'Nx': Nx, 'time': time_str(head[0]), 'end': start+nvar*Nx*8, 'vars': {}}
+            for j in range(nvar):
+                rec['vars'][names[j].decode()]=start+j*Nx*8
+            records.append(rec)
+            f.seek(start+nvar*Nx*8)
+    return records
+
+# Outputs in store; variables saved as (file, row)
+def read_index_store(directory='.'):
+    times=np.fromfile(os.path.join(directory, store_prefix+'times.dat'), dtype=float)
+    times=times.reshape(-1,N_TIME)
+    names=[name[len(store_prefix):-4] for name in os.listdir(directory)\
+           if name.startswith(store_prefix) and name!=store_prefix+'times.dat']
+    records=[]
+    for i in np.flatnonzero(~np.isnan(times[:,0])):
+        path={}
+        for name in names:
+            path[name]=(os.path.join(directory, store_prefix+name+'.dat'), i)
+        Nx=os.path.getsize(path[names[0]][0])//(8*len(times))
+        records.append({'t': times[i,0], 'nt': int(times[i,1]), 'dt': times[i,2],\
+                        'ign': int(times[i,3]), 'Nx': Nx, 'time': time_str(times[i,0]),\
+                        'vars': path})
+    return records
+
+# Record with time (ms, as in data file names) containing given string
+def find_record(records, time):
+    for rec in records:
+        if rec['time'].find(str(time))>=0:
+            return rec
+    return None
+
+# Values of variable in record at given nodes (slice; default all); None if
+# not saved. Only those nodes are read from file
+def read_var(rec, name, directory='.', nodes=slice(None)):
+    if name not in rec['vars']:
+        return None
+    st_i,en_i,step=nodes.indices(rec['Nx'])
+    # Store; row of memory-mapped file
+    if type(rec['vars'][name]) is tuple:
+        path,row=rec['vars'][name]
+        f=np.memmap(path, dtype=float, mode='r')
+        return np.array(f[row*rec['Nx']+st_i:row*rec['Nx']+en_i:step])
+    with open(os.path.join(directory, file_name), 'rb') as f:
+        f.seek(rec['vars'][name]+st_i*8)
+        return np.fromfile(f, dtype=float, count=en_i-st_i)[::step]
@@ -9,9 +9,15 @@ import numpy as np
 #from pdb import set_trace as keyboard
 
 scheme_data = {
-		"RK2":{}, "RK3":{}, "RK4":{}, "RK4_CLASSICAL":{}, "RK4_LOW":{}, "RK6":{}
+		"EULER":{}, "RK2":{}, "RK3":{}, "RK4":{}, "RK4_CLASSICAL":{}, "RK4_LOW":{}, "RK6":{}
 		}
 
+scheme_data["EULER"]["rk_substep_fraction"] = np.array([1.]).astype("float64")
+scheme_data["EULER"]["rk_coeff"] = [
+               			  [0.]
+               			 ]
+scheme_data["EULER"]["information"] = "This is the forward Euler method"
+
 scheme_data["RK2"]["rk_substep_fraction"] = np.array([1./2., 1./2.]).astype("float64")
 scheme_data["RK2"]["rk_coeff"] = [
                			  [0.       ,     0. ],
@@ -29,13 +35,13 @@ scheme_data["RK3"]["rk_coeff"] = [
                			 ]
 scheme_data["RK3"]["information"] = "This is the general RK3 method"
 '''
-scheme_data["RK3"]["rk_substep_fraction"] = np.array([8./15.,2./15.,1./3.]).astype("float64")
+scheme_data["RK3"]["rk_substep_fraction"] = np.array([1./4., 0., 3./4.]).astype("float64")
 scheme_data["RK3"]["rk_coeff"] = [
-               			  [8./15. ,     0. ,     0.  ],
-               			  [-17./60., 5./12. ,     0. ],
-               			  [  0.     , -5./12., 3./4. ]
+               			  [0.     ,     0. ,     0.  ],
+               			  [8./15. ,     0. ,     0. ],
+               			  [1./4.  ,  5./12.,     0. ]
                			 ]
-scheme_data["RK3"]["information"] = "This is Wray's low-storage method"
+scheme_data["RK3"]["information"] = "This is Wray's low-storage method (Butcher form)"
 
 
 scheme_data["RK4"]["rk_substep_fraction"] = np.array([1./6., 1./3., 1./3., 1./6.]).astype("float64")
@@ -64,6 +70,8 @@ scheme_data["RK4_LOW"]["rk_coeff"] = [
        					[ 0.07801568,  0.0470887 ,  0.69991726,  0.        ]
 				    ]
 scheme_data["RK4_LOW"]["information"] = "This is the low storage 4 step method"
+# Coefficients are in low-storage form, not a Butcher tableau; not selectable
+scheme_data["RK4_LOW"]["butcher"] = False
 scheme_data["RK6"]["rk_substep_fraction"] = np.array([1./12., 0., 0., 0., 5./12., 5./12., 1./12.]).astype("float64")
 scheme_data["RK6"]["rk_coeff"] = \
 [
@@ -147,14 +155,51 @@ scheme_data["RK8"]["rk_coeff"] = \
 
 scheme_data["RK8"]["information"] = "This is the 11 step 8th order RUNGE KUTTA method 9th order accuracy "
 
+#########################################################################################################
+################## EMBEDDED PAIRS (ADAPTIVE TIME STEPPING) ##############################################
+#########################################################################################################
+# rk_embedded_fraction are the weights of the lower order solution used for the error estimate
+# rk_embedded_order is the order of the lower order solution
+
+scheme_data["RK3_BS"] = {}
+scheme_data["RK3_BS"]["rk_substep_fraction"] = np.array([2./9., 1./3., 4./9., 0.]).astype("float64")
+scheme_data["RK3_BS"]["rk_embedded_fraction"] = np.array([7./24., 1./4., 1./3., 1./8.]).astype("float64")
+scheme_data["RK3_BS"]["rk_embedded_order"] = 2
+scheme_data["RK3_BS"]["rk_coeff"] = [
+               			  [0.    ,   0. ,    0. ,  0.],
+               			  [1./2. ,   0. ,    0. ,  0.],
+               			  [0.    , 3./4.,    0. ,  0.],
+				        [2./9. , 1./3.,  4./9. ,  0.]
+               			 ]
+scheme_data["RK3_BS"]["information"] = "This is the Bogacki-Shampine 3(2) embedded pair"
+
+scheme_data["RK5_DP"] = {}
+scheme_data["RK5_DP"]["rk_substep_fraction"] = np.array([35./384., 0., 500./1113., 125./192., -2187./6784., 11./84., 0.]).astype("float64")
+scheme_data["RK5_DP"]["rk_embedded_fraction"] = np.array([5179./57600., 0., 7571./16695., 393./640., -92097./339200., 187./2100., 1./40.]).astype("float64")
+scheme_data["RK5_DP"]["rk_embedded_order"] = 4
+scheme_data["RK5_DP"]["rk_coeff"] = \
+[
+ [ 0.           ,  0.           ,  0.           ,  0.         ,  0.            ,  0.     ,  0.],
+ [ 1./5.        ,  0.           ,  0.           ,  0.         ,  0.            ,  0.     ,  0.],
+ [ 3./40.       ,  9./40.       ,  0.           ,  0.         ,  0.            ,  0.     ,  0.],
+ [ 44./45.      , -56./15.      ,  32./9.       ,  0.         ,  0.            ,  0.     ,  0.],
+ [ 19372./6561. , -25360./2187. ,  64448./6561. , -212./729.  ,  0.            ,  0.     ,  0.],
+ [ 9017./3168.  , -355./33.     ,  46732./5247. ,  49./176.   , -5103./18656.  ,  0.     ,  0.],
+ [ 35./384.     ,  0.           ,  500./1113.   ,  125./192.  , -2187./6784.   ,  11./84. ,  0.]
+]
+scheme_data["RK5_DP"]["information"] = "This is the Dormand-Prince 5(4) embedded pair"
+
 
 
 class runge_kutta():
     ''' Pass scheme name as a string '''
     def __init__(self, scheme):
         self.scheme = scheme.upper()
-        if scheme.upper() not in scheme_data.keys():
-            print "Unrecognized Runge Kutta scheme " + scheme
+        if scheme.upper() not in self.listSupportedSchemes():
+            if scheme.upper() in scheme_data.keys():
+                print "Runge Kutta scheme " + scheme + " has no Butcher tableau"
+            else:
+                print "Unrecognized Runge Kutta scheme " + scheme
             print "Select from : ", sorted(self.listSupportedSchemes())
             print "Or 'Euler' "
             self.Nk=-1
@@ -162,6 +207,11 @@ class runge_kutta():
         self.rk_substep_fraction =   scheme_data[self.scheme]["rk_substep_fraction"]
         self.Nk			 =   self.rk_substep_fraction.size	# Total number of steps
         self.rk_coeff 		 =   scheme_data[self.scheme]["rk_coeff"]
+        # Embedded pair; error estimate weights for adaptive time stepping
+        self.adaptive		 =   "rk_embedded_fraction" in scheme_data[self.scheme]
+        if self.adaptive:
+            self.rk_error_fraction =   self.rk_substep_fraction-scheme_data[self.scheme]["rk_embedded_fraction"]
+            self.rk_embedded_order =   scheme_data[self.scheme]["rk_embedded_order"]
 
     def listSupportedSchemes(self):
-        return scheme_data.keys()
+        return [key for key in scheme_data.keys() if scheme_data[key].get("butcher", True)]
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+######################################################
+#             1D Heat Conduction Solver              #
+#              Created by J. Mark Epps               #
+#          Part of Masters Thesis at UW 2018-2020    #
+######################################################
+
+This file contains the traveling wave solver for the steady combustion wave speed:
+    -Uses FileClasses.py to read the same input file as main.py
+    -Solves steady combustion wave in frame moving with front (x-v*t); speed v
+    is an unknown of the boundary value problem (nonlinear eigenvalue)
+    -Can be called from command line with:
+        python wave_speed.py [Input file name+extension] [Nodes (optional)]
+    -Transient solver (main.py) kept for validation of wave speed
+
+Features/assumptions:
+    -Energy and reaction progress equations of transient solver in wave frame:
+        v*dE/dx + d/dx(k*dT/dx) + Q = 0 and v*d(eta)/dx + rate = 0
+    where rate is Kim source rate (Source_Comb.py) and properties are
+    from GeomClasses calcProp (same interpolation of k to faces as solver)
+    -Burnt material on left (zero temperature gradient), unburnt on right at
+    initial temperature (300 K); front fixed at eta=0.5 at one node
+    -Species model: solid converted to gas where it reacts (gas_gen); gas stays
+    with solid (Darcy flow not modelled)
+    -Second order upwind differences for dE/dx and d(eta)/dx; central
+    differences for conduction
+    -Newton's method with step halving; Jacobian by finite differences (nodes
+    perturbed 4 at a time as each equation only involves 4 neighbouring nodes)
+    -Domain length from estimates of flame thickness; speed from grid with
+    twice as many nodes reported as a check of resolution
+    -Ensemble input files; wave speed of each member
+
+"""
+
+import numpy as np
+import string as st
+import sys
+import time
+import copy
+
+import GeomClasses as Geom
+import FileClasses
+import Source_Comb
+
+class Traveling_wave():
+    def __init__(self, settings, Sources, Species, Nodes):
+        self.settings=copy.deepcopy(settings)
+        self.Sources=Sources
+        self.Species=Species
+        self.N=Nodes
+        self.T_0=300.0 # Temperature of unburnt material (as in main.py)
+        self.eta_f=0.5 # Progress at front node
+        self.x_f=0.6 # Location of front node (fraction of length from burnt end)
+        self.thick=30.0 # Length of domain (flame thicknesses)
+        self.diff_inter=settings['diff_interpolation']
+        self.source=Source_Comb.Source_terms(Sources['Ea'], Sources['A0'], Sources['dH'], \
+                                            Sources['gas_gen'], Sources['Rate_table'])
+        self.tol=10**(-9) # Convergence of Newton iterations (scaled residual)
+        self.max_iter=50
+        self.Domain=None
+
+    # Domain of given length and nodes (properties evaluated on its nodes)
+    def create_domain(self, L, N):
+        self.settings['Length']=L
+        self.settings['Nodes_x']=N
+        self.N=N
+        d=Geom.OneDimLine(self.settings, self.Species, 'Solid', 0)
+        d.mesh()
+        d.create_var(self.Species)
+        self.Domain=d
+        self.h=d.dx[0]
+        self.i_f=int(self.x_f*(N-1))
+        if d.model=='Species':
+            self.rho_IC=[d.rho_species[i].copy() for i in d.species_keys]
+
+    # Energy (E=rhoC*T), conductivity, energy source and reaction rate
+    def props(self, T, eta):
+        d=self.Domain
+        d.eta=eta
+        if d.model=='Species':
+            m=self.source.gas_gen*d.rho_0*eta # Solid converted to gas
+            d.rho_species[d.species_keys[0]]=self.rho_IC[0]+m
+            d.rho_species[d.species_keys[1]]=self.rho_IC[1]-m
+        T_c, k, rhoC, Cp=d.calcProp(T_guess=T)
+        Q, rate=self.source.Source_Comb_Kim_rate(d.rho_0, T, eta)
+        return rhoC*T, k, Q, rate
+
+    # Interpolation of k to faces (same as solver)
+    def interpolate(self, k1, k2):
+        if self.diff_inter=='Linear':
+            return 0.5*k1+0.5*k2
+        else:
+            return 2*k1*k2/(k1+k2)
+
+    # Second order upwind difference (unburnt side, +x); first order next to boundary
+    def upwind(self, u):
+        du=np.zeros_like(u)
+        du[:-2]=(-3*u[:-2]+4*u[1:-1]-u[2:])/(2*self.h)
+        du[-2]=(u[-1]-u[-2])/self.h
+        return du
+
+    # Residuals of energy equations, progress equations and front condition;
+    # y=[T, eta, v]; scaled by adiabatic temperature rise and reaction rate
+    def residual(self, y):
+        N=self.N
+        T,eta,v=y[:N],y[N:2*N],y[-1]
+        E,k,Q,rate=self.props(T, eta)
+        R=np.zeros(2*N+1)
+
+        # Energy
+        flux=self.interpolate(k[1:], k[:-1])*(T[1:]-T[:-1])/self.h
+        R[1:N-1]=v*self.upwind(E)[1:-1]+(flux[1:]-flux[:-1])/self.h+Q[1:-1]
+        R[1:N-1]/=self.E_scale
+        R[0]=(-3*T[0]+4*T[1]-T[2])/self.dT
+        R[N-1]=(T[-1]-self.T_0)/self.dT
+
+        # Reaction progress
+        R[N:2*N-1]=(v*self.upwind(eta)[:-1]+rate[:-1])/self.rate_ad
+        R[2*N-1]=eta[-1]
+
+        # Front location
+        R[-1]=eta[self.i_f]-self.eta_f
+        return R
+
+    # Jacobian by finite differences; T and eta at every 4th node perturbed
+    # together (residual at node i depends on nodes i-1 to i+2)
+    def jacobian(self, y, R):
+        N=self.N
+        J=np.zeros((2*N+1, 2*N+1))
+        rows=np.arange(N)
+        for var in [0,1]:
+            dy=10**(-7)*np.maximum(np.abs(y[var*N:(var+1)*N]), [self.T_0, 1.0][var])
+            for c in range(4):
+                y_p=y.copy()
+                y_p[var*N+c:(var+1)*N:4]+=dy[c::4]
+                dR=self.residual(y_p)-R
+                # Perturbed node in stencil of each equation
+                j=rows-1+(c-rows+1)%4
+                on=(j>=0)&(j<N)
+                for eq in [0,1]:
+                    J[eq*N+rows[on], var*N+j[on]]=dR[eq*N+rows[on]]/dy[j[on]]
+        J[-1,N+self.i_f]=1.0
+        dv=10**(-7)*y[-1]
+        y_p=y.copy()
+        y_p[-1]+=dv
+        J[:,-1]=(self.residual(y_p)-R)/dv
+        return J
+
+    # Adiabatic flame temperature; energy of burnt material is energy of
+    # unburnt material plus heat released
+    def adiabatic(self):
+        T,eta=np.ones(self.N)*self.T_0,np.zeros(self.N)
+        E_0,k_0,Q,rate=self.props(T, eta)
+        Q_tot=self.source.dH[1]
+        if st.find(self.source.dH[0], 'vol')<0:
+            Q_tot*=self.Domain.rho_0[0]
+        T_ad=T[0]+Q_tot/(E_0[0]/T[0])
+        for i in range(20):
+            E,k,Q,rate=self.props(np.ones(self.N)*T_ad, np.ones(self.N))
+            T_ad=(E_0[0]+Q_tot)/(E[0]/T_ad)
+        return T_ad, k[0], E[0]/T_ad, rate
+
+    # Initial guess; front of thickness given by estimates of preheat zone (conduction)
+    # and reaction zone (rate at adiabatic temperature); speed from high
+    # activation energy estimate
+    def guess(self):
+        self.create_domain(1.0, self.N)
+        T_ad,k,rhoC,rate=self.adiabatic()
+        Ea=np.amax(self.source.Ea)
+        A_ad=np.amax(self.source.A0*np.exp(-Ea/self.source.R/T_ad))
+        v=np.sqrt(2*k/rhoC*A_ad*self.source.R*T_ad**2/Ea/(T_ad-self.T_0))
+        thick=max(k/rhoC/v, v/A_ad)
+        self.create_domain(self.thick*thick, self.N)
+        self.T_ad,self.dT,self.rate_ad=T_ad,T_ad-self.T_0,A_ad
+        self.E_scale=rhoC*self.dT*A_ad
+        x=(self.Domain.X-self.Domain.X[self.i_f])/thick
+        eta=0.5*(1-np.tanh(x))
+        T=self.T_0+self.dT*eta
+        return np.concatenate((T, eta, [v]))
+
+    # Newton's method; step halved until scaled residual decreases
+    # Returns solution and number of iterations (negative if not converged)
+    def Newton(self, y):
+        R=self.residual(y)
+        norm=np.amax(np.abs(R))
+        for it in range(self.max_iter):
+            if norm<self.tol:
+                return y, it
+            dy=np.linalg.solve(self.jacobian(y, R), -R)
+            lam=1.0
+            for i in range(30):
+                y_new=y+lam*dy
+                if y_new[-1]>0 and np.amin(y_new[:self.N])>0:
+                    R_new=self.residual(y_new)
+                    norm_new=np.amax(np.abs(R_new))
+                    if norm_new<norm:
+                        break
+                lam*=0.5
+            else:
+                return y, -it
+            y,R,norm=y_new,R_new,norm_new
+        return y, -self.max_iter
+
+    # Solve on N nodes then on twice as many nodes (interpolated from first)
+    # Returns speeds, solutions and iterations
+    def solve(self):
+        y,it=self.Newton(self.guess())
+        X,N=self.Domain.X,self.N
+        self.create_domain(self.Domain.L, 2*N-1)
+        X_2=self.Domain.X
+        y_2=np.concatenate((np.interp(X_2, X, y[:N]), np.interp(X_2, X, y[N:2*N]), [y[-1]]))
+        y_2,it_2=self.Newton(y_2)
+        return (y[-1], y_2[-1]), (y, y_2), (it, it_2)
+
+if __name__=='__main__':
+    print('######################################################')
+    print('#             1D Heat Conduction Solver              #')
+    print('#              Created by J. Mark Epps               #')
+    print('#          Part of Masters Thesis at UW 2018-2020    #')
+    print('######################################################\n')
+
+    # Get arguments to script execution
+    settings={}
+    BCs={}
+    Sources={}
+    Species={}
+    inputargs=sys.argv
+    if len(inputargs)>1:
+        input_file=inputargs[1]
+        Nodes=400
+        if len(inputargs)>2:
+            Nodes=int(inputargs[2])
+    else:
+        print 'Usage is: python wave_speed.py [Input file] [Nodes (optional)]\n'
+        print 'where\n'
+        print '[Input file] is the name of the input file with extension; must be in current directory'
+        print '[Nodes] is the number of nodes across wave (default 400); solved again with twice the nodes'
+        print '***********************************'
+        sys.exit('Traveling wave solver shut down')
+
+    print 'Reading input file...'
+    fin=FileClasses.FileIn(input_file, 0)
+    fin.Read_Input(settings, Sources, Species, BCs)
+    if st.find(Sources['Source_Kim'], 'True')<0:
+        sys.exit('Traveling wave solver requires Source_Kim')
+
+    # Ensemble members solved one at a time
+    members=settings['Members']
+    if members<1:
+        sys.exit('Values for ensemble members must all have the same number of members')
+    for i in range(members):
+        settings_i,Sources_i,BCs_i=FileClasses.ensemble_member(settings, Sources, BCs, i)
+        if members>1:
+            print '################################'
+            print 'Ensemble member %i:'%(i+1)
+        time_begin=time.time()
+        wave=Traveling_wave(settings_i, Sources_i, Species, Nodes)
+        v,y,it=wave.solve()
+        if min(it)<0:
+            print 'Newton iterations did not converge'
+        print 'Adiabatic temperature: %f K'%(wave.T_ad)
+        print 'Domain length: %f mm'%(wave.Domain.L*1000)
+        print 'Wave speed (%i nodes): %f m/s'%((wave.N+1)/2, v[0])
+        print 'Wave speed (%i nodes): %f m/s'%(wave.N, v[1])
+        print 'Newton iterations: %i, %i'%(abs(it[0]), abs(it[1]))
+        print 'Solver time: %f s'%(time.time()-time_begin)